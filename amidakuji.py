@@ -1,46 +1,218 @@
+import argparse
+import bisect
+import math
+import mmap
+import multiprocessing
+import os
 import random
 import pygame
+import struct
 import sys
+import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 MARGIN_LEFT = 50  # px
 MARGIN_TOP = 50   # px
 LINE_WIDTH = 5    # px
 FONT_SIZE = 20
-FPS = 30
+FPS = 60
+SPEED = 150  # px/s
+DURATION = 10  # s, longest a ladder takes to run down at normal speed
+FAST_FORWARD = 8  # speed multiplier while space is held
+TRAIL_BUDGET = 0.5  # share of a frame the trail may take to catch up
+VIEW_WIDTH = 800   # px, largest window; bigger ladders scroll
+VIEW_HEIGHT = 600  # px
+ZOOMS = (0.25, 0.5, 1, 2)
+PAN_SPEED = 600  # px/s while an arrow key is held
+LABEL_CACHE = 1024  # rendered labels kept
+RUNG_PROBABILITY = 0.3
+RUNG_SPACING = LINE_WIDTH * 2  # px
+
+# saved ladder: header (magic, version, lanes, height, start lane, rung count,
+# size of the results), the results as newline separated UTF-8 padded to 4 bytes,
+# then the rung ys as int32 and their left lanes as uint16, all little-endian
+LADDER_MAGIC = b'AMDK'
+LADDER_VERSION = 1
+LADDER_HEADER = struct.Struct('<4sHHIIII')
 
 BLACK = (0, 0, 0)
 RED = (255, 0, 0)
 WHITE = (255, 255, 255)
 
-class Horizontal:
-    def __init__(self, game, vertical_left, vertical_right, y):
-        self.__game = game
-        self.__vertical_left = vertical_left
-        self.__vertical_right = vertical_right
+def lane_name(index):
+    # A to Z, then AA, AB and so on like spreadsheet columns
+    name = ''
+    index += 1
+    while index:
+        index, letter = divmod(index - 1, 26)
+        name = chr(ord('A') + letter) + name
+    return name
+
+class Ladder:
+    def __init__(self, lanes, height, ys=None, lefts=None, rng=random):
+        self.__lanes = lanes
+        self.__height = height
+        self.__rng = rng
+        if ys is None:
+            ys, lefts = self.__generate()
+        # one rung per y: ys is strictly increasing, lefts[i] is the left lane of the rung at ys[i]
+        self.__ys = ys
+        self.__lefts = lefts
 
-        self.__start_pos = (self.__vertical_left.start_pos[0], y)
-        self.__end_pos = (self.__vertical_right.start_pos[0], y)
+    @property
+    def lanes(self):
+        return self.__lanes
 
     @property
-    def start_pos(self):
-        return self.__start_pos
+    def height(self):
+        return self.__height
 
     @property
-    def end_pos(self):
-        return self.__end_pos
+    def ys(self):
+        return self.__ys
+
+    @property
+    def lefts(self):
+        return self.__lefts
+
+    def rungs(self):
+        # (y, left lane) of every rung in order of y, read as they are needed
+        return zip(self.__ys, self.__lefts)
+
+    def __generate(self):
+        # Sweeps y downwards and every y from lane 0 rightwards, each slot getting
+        # a rung with RUNG_PROBABILITY. A rung moves the sweep RUNG_SPACING down and
+        # two lanes right, so rungs never touch. The failed slots before the next
+        # rung follow a geometric distribution, so one draw places each rung.
+        ys = array('i')
+        lefts = array('i')
+        slots = self.__lanes - 1  # lanes a rung can start from
+        if slots < 1:
+            return ys, lefts
+
+        miss = math.log(1 - RUNG_PROBABILITY)
+        end = self.__height - LINE_WIDTH
+        y = LINE_WIDTH
+        i = 0
+        while True:
+            i += int(math.log(1 - self.__rng.random()) / miss)
+            y += i // slots
+            i %= slots
+            if y >= end:
+                return ys, lefts
+            ys.append(y)
+            lefts.append(i)
+
+            i += 2
+            y += RUNG_SPACING
+            if i >= slots:
+                i = 0
+                y += 1
+
+    def permutation(self):
+        # end lane of every start lane: each rung swaps whatever sits on its two
+        # lanes, so one pass over the rungs in order of y answers every start lane
+        starts = list(range(self.__lanes))  # start lane currently on each lane
+        for left in self.__lefts:
+            starts[left], starts[left + 1] = starts[left + 1], starts[left]
+
+        ends = [0] * self.__lanes
+        for lane, start in enumerate(starts):
+            ends[start] = lane
+        return ends
+
+class Viewport:
+    # the part of the ladder on screen: a fixed-size window onto the whole
+    # drawing, zoomed and moved around in drawing coordinates
+    def __init__(self, width, height, world_width, world_height):
+        self.__width = width    # px on screen
+        self.__height = height  # px on screen
+        self.__world_width = world_width
+        self.__world_height = world_height
+        self.__zoom = 1
+        self.__x = 0  # drawing position of the top left corner
+        self.__y = 0
+        self.__following = True
+        self.__clamp()
+
+    @property
+    def zoom(self):
+        return self.__zoom
+
+    @property
+    def following(self):
+        return self.__following
+
+    @property
+    def left(self):
+        return self.__x
 
-    def get_next_vertical(self, current_vertical):
-        return self.__vertical_right if current_vertical == self.__vertical_left else self.__vertical_left
+    @property
+    def top(self):
+        return self.__y
 
-    def draw(self):
-        pygame.draw.line(self.__game.window, BLACK, self.__start_pos, self.__end_pos, LINE_WIDTH)
+    @property
+    def right(self):
+        return self.__x + self.__width / self.__zoom
+
+    @property
+    def bottom(self):
+        return self.__y + self.__height / self.__zoom
+
+    def to_screen(self, pos):
+        return (round((pos[0] - self.__x) * self.__zoom), round((pos[1] - self.__y) * self.__zoom))
+
+    def scale(self, length):
+        return max(1, round(length * self.__zoom))
+
+    def follow(self, pos=None):
+        # centre on pos from now on, or again if pos is None
+        self.__following = True
+        if pos is not None:
+            self.__x = pos[0] - self.__width / self.__zoom / 2
+            self.__y = pos[1] - self.__height / self.__zoom / 2
+            self.__clamp()
+
+    def pan(self, dx, dy):
+        # by screen px; stops following the dot
+        self.__following = False
+        self.__x += dx / self.__zoom
+        self.__y += dy / self.__zoom
+        self.__clamp()
+
+    def zoom_by(self, steps):
+        # to a neighbouring entry of ZOOMS, keeping the centre where it is
+        index = ZOOMS.index(self.__zoom) + steps
+        zoom = ZOOMS[min(max(index, 0), len(ZOOMS) - 1)]
+        centre = ((self.left + self.right) / 2, (self.top + self.bottom) / 2)
+        self.__zoom = zoom
+        self.__x = centre[0] - self.__width / zoom / 2
+        self.__y = centre[1] - self.__height / zoom / 2
+        self.__clamp()
+
+    def __clamp(self):
+        # keep the view on the drawing, centring the drawing when it is smaller
+        span = self.__width / self.__zoom
+        if self.__world_width <= span:
+            self.__x = (self.__world_width - span) / 2
+        else:
+            self.__x = min(max(self.__x, 0), self.__world_width - span)
+        span = self.__height / self.__zoom
+        if self.__world_height <= span:
+            self.__y = (self.__world_height - span) / 2
+        else:
+            self.__y = min(max(self.__y, 0), self.__world_height - span)
 
 class Vertical:
     def __init__(self, game, name, result, index, start=False, end=False):
         self.__game = game
         self.__name = name
         self.__result = result
-        self.__horizontals = {}
         self.__start = start
         self.__end = end
 
@@ -55,10 +227,6 @@ class Vertical:
     def result(self):
         return self.__result
 
-    @property
-    def horizontals(self):
-        return self.__horizontals
-
     @property
     def start_pos(self):
         return self.__start_pos
@@ -67,53 +235,57 @@ class Vertical:
     def end_pos(self):
         return self.__end_pos
 
-    def get_horizontal(self, y):
-        return self.__horizontals.get(y)
-
-    def set_horizontal(self, y, horizontal):
-        self.__horizontals[y] = horizontal
-
     def set_start(self):
         self.__start = True
 
     def set_end(self):
         self.__end = True
 
-    def __write_name(self):
-        text_surface = self.__game.label_font.render(self.__name, True, RED if self.__start else BLACK)
-        text_width = text_surface.get_width()
-        text_height = text_surface.get_height()
-        self.__game.window.blit(text_surface, (self.__start_pos[0] - (text_width / 2), (self.__start_pos[1] + FONT_SIZE) - (text_height * 3)))
-
-    def __write_result(self):
-        text_surface = self.__game.label_font.render(self.__result, True, RED if self.__end else BLACK)
-        text_width = text_surface.get_width()
-        text_height = text_surface.get_height()
-        self.__game.window.blit(text_surface, (self.__end_pos[0] - (text_width / 2), (self.__end_pos[1] + FONT_SIZE) - (text_height / 2)))
-
-    def draw(self):
-        pygame.draw.line(self.__game.window, BLACK, self.__start_pos, self.__end_pos, LINE_WIDTH)
-        self.__write_name()
-        self.__write_result()
+    def __write(self, surface, view, text, color, y, rise):
+        # text centred on the line, its top rise label heights above y
+        text_surface = self.__game.label(text, color)
+        text_height = text_surface.get_height() / view.zoom
+        left, top = view.to_screen((self.__start_pos[0], y + FONT_SIZE - text_height * rise))
+        surface.blit(text_surface, (left - text_surface.get_width() // 2, top))
+
+    def draw(self, surface, view):
+        # only the part of the line inside the view
+        top = max(self.__start_pos[1], view.top)
+        bottom = min(self.__end_pos[1], view.bottom)
+        if top < bottom:
+            pygame.draw.line(surface, BLACK, view.to_screen((self.__start_pos[0], top)), view.to_screen((self.__end_pos[0], bottom)), view.scale(LINE_WIDTH))
+        self.__write(surface, view, self.__name, RED if self.__start else BLACK, self.__start_pos[1], 3)
+        self.__write(surface, view, self.__result, RED if self.__end else BLACK, self.__end_pos[1], 0.5)
 
 class Game:
-    def __init__(self):
-        self.__results = sys.argv[1:len(sys.argv) - 1]
+    def __init__(self, results, height, ladder=None, start=None, rng=random, speed=SPEED, duration=DURATION):
+        self.__results = results
         self.__results_len = len(self.__results)
-        self.__height = int(sys.argv[-1])
+        self.__height = height
+        self.__speed = max(speed, height / duration)  # px/s
+        self.__ladder = ladder or Ladder(self.__results_len, self.__height, rng=rng)
 
         self.__verticals = [
-            Vertical(self, chr(ord('A') + i), result, i + 1)
+            Vertical(self, lane_name(i), result, i + 1)
             for i, result in enumerate(self.__results)
         ]
 
         self.__label_font = pygame.font.SysFont(None, FONT_SIZE)
-        self.__window_width = self.__results_len * (MARGIN_LEFT * 2)
-        self.__window_height = self.__height + (MARGIN_TOP * 3)
+        self.__labels = {}  # (text, colour, zoom) -> surface, least recently used first
+
+        # the whole drawing can be far bigger than the screen, so the window
+        # shows a part of it and everything outside that part is skipped
+        self.__world_width = (self.__results_len + 1) * MARGIN_LEFT
+        self.__world_height = self.__height + (MARGIN_TOP * 3)
+        self.__window_width = min(self.__world_width, VIEW_WIDTH)
+        self.__window_height = min(self.__world_height, VIEW_HEIGHT)
         self.__window = pygame.display.set_mode((self.__window_width, self.__window_height))
+        self.__view = Viewport(self.__window_width, self.__window_height, self.__world_width, self.__world_height)
 
-        self.__vertical_index = random.randint(0, self.__results_len - 1)
-        self.__traversed = []  # will store the trail lines
+        self.__vertical_index = rng.randint(0, self.__results_len - 1) if start is None else start
+        # corners of the trail so far, in order of y, and their ys for culling
+        self.__trail = []
+        self.__trail_ys = []
 
     @property
     def window(self):
@@ -127,99 +299,328 @@ class Game:
     def label_font(self):
         return self.__label_font
 
-    def start(self):
-        self.__prepare()
+    def label(self, text, color):
+        # each label is rendered once per zoom level and dropped once unused for long
+        zoom = self.__view.zoom
+        key = (text, color, zoom)
+        text_surface = self.__labels.pop(key, None)
+        if text_surface is None:
+            text_surface = self.__label_font.render(text, True, color)
+            if zoom != 1:
+                size = (max(1, round(text_surface.get_width() * zoom)), max(1, round(text_surface.get_height() * zoom)))
+                text_surface = pygame.transform.smoothscale(text_surface, size)
+            if len(self.__labels) >= LABEL_CACHE:
+                del self.__labels[next(iter(self.__labels))]
+        self.__labels[key] = text_surface
+        return text_surface
 
-        current_vertical = self.__verticals[self.__vertical_index]
+    def start(self):
+        lane = self.__vertical_index
+        current_vertical = self.__verticals[lane]
         current_vertical.set_start()
-        y = 0
+        last = self.__height - 1  # y where the dot stops
+        goal = 0.0  # y the dot should have reached by now
+        y = 0  # y the trail has been drawn to
 
-        pos_x = current_vertical.start_pos[0]
-        pos_y = MARGIN_TOP + y
-        prev_pos = (pos_x, pos_y)
+        pos = (current_vertical.start_pos[0], MARGIN_TOP + y)
+        self.__add_to_trail(pos)
+        self.__view.follow(pos)
+
+        # rungs arrive in order of y, so only the next one ever needs looking at
+        rungs = self.__ladder.rungs()
+        rung = next(rungs, None)
 
         clock = pygame.time.Clock()
         running = True
+        changed = True  # whether the screen needs drawing again
 
-        while running or y < self.__height:
+        while running or y < last:
+            elapsed = clock.tick(FPS) / 1000  # s
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     running = False
-
-            self.__window.fill(WHITE)
-
-            # draw verticals and horizontals
-            drawn = set()
-            for v in self.__verticals:
-                v.draw()
-                for h in v.horizontals.values():
-                    if h not in drawn:
-                        h.draw()
-                        drawn.add(h)
-
-            if y < self.__height:
-                pos_x = current_vertical.start_pos[0]
-                pos_y = MARGIN_TOP + y
-            else:
-                current_vertical.set_end()
-
-            # check horizontal at this step
-            current_horizontal = current_vertical.get_horizontal(y)
-            if current_horizontal:
-                next_vertical = current_horizontal.get_next_vertical(current_vertical)
-                # add horizontal segment to trail
-                self.__traversed.append(((pos_x, pos_y), (next_vertical.start_pos[0], pos_y)))
-                current_vertical = next_vertical
-                pos_x = current_vertical.start_pos[0]  # update x after jump
-
-            # add vertical segment to trail
-            self.__traversed.append((prev_pos, (pos_x, pos_y)))
-            prev_pos = (pos_x, pos_y)
-
-            # draw the trail
-            for line in self.__traversed:
-                pygame.draw.line(self.__window, RED, line[0], line[1], 3)
-
-            # draw current circle
-            pygame.draw.circle(self.__window, RED, (pos_x, pos_y), 5)
-
-            self.__cover(pos_y)
-
-            y += 1
-            pygame.display.flip()
-            clock.tick(FPS)
-
-    def __prepare(self):
-        y = LINE_WIDTH
-        while y < (self.__height - LINE_WIDTH):
-            i = 0
-            while i < self.__results_len - 1:
-                if random.random() < 0.3:
-                    left = self.__verticals[i]
-                    right = self.__verticals[i + 1]
-
-                    if left.get_horizontal(y) is None and right.get_horizontal(y) is None:
-                        horizontal = Horizontal(self, left, right, MARGIN_TOP + y)
-                        left.set_horizontal(y, horizontal)
-                        right.set_horizontal(y, horizontal)
-                        i += 2
-                        y += (LINE_WIDTH * 2)
-                        continue
-                i += 1
-            y += 1
+                elif event.type == pygame.MOUSEWHEEL and event.y:
+                    self.__view.zoom_by(1 if event.y > 0 else -1)
+                    changed = True
+                elif event.type == pygame.KEYDOWN:
+                    if event.key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS):
+                        self.__view.zoom_by(1)
+                    elif event.key in (pygame.K_MINUS, pygame.K_KP_MINUS):
+                        self.__view.zoom_by(-1)
+                    elif event.key == pygame.K_f:
+                        self.__view.follow(pos)
+                    changed = True
+
+            keys = pygame.key.get_pressed()
+            dx = keys[pygame.K_RIGHT] - keys[pygame.K_LEFT]
+            dy = keys[pygame.K_DOWN] - keys[pygame.K_UP]
+            if dx or dy:
+                self.__view.pan(dx * PAN_SPEED * elapsed, dy * PAN_SPEED * elapsed)
+                changed = True
+
+            if y < last:
+                speed = self.__speed * (FAST_FORWARD if keys[pygame.K_SPACE] else 1)
+                goal = min(goal + speed * elapsed, last)
+                deadline = time.perf_counter() + TRAIL_BUDGET / FPS
+
+                # jump from rung to rung up to the goal; when a frame runs out of time
+                # the dot stops short and catches up over the following frames
+                y = int(goal)
+                while rung is not None and rung[0] <= goal:
+                    rung_y, left = rung
+                    if lane in (left, left + 1):
+                        lane = left + 1 if lane == left else left
+                        next_vertical = self.__verticals[lane]
+                        # add vertical segment down to the rung and the horizontal across it
+                        self.__add_to_trail((pos[0], MARGIN_TOP + rung_y))
+                        current_vertical = next_vertical
+                        pos = (current_vertical.start_pos[0], MARGIN_TOP + rung_y)
+                        self.__add_to_trail(pos)
+                    rung = next(rungs, None)
+                    if rung is not None and time.perf_counter() > deadline:
+                        y = min(y, rung[0] - 1)
+                        break
+
+                pos = (pos[0], MARGIN_TOP + y)
+                if y == last:
+                    current_vertical.set_end()
+                    self.__add_to_trail(pos)
+                if self.__view.following:
+                    self.__view.follow(pos)
+                changed = True
+
+            if changed:
+                self.__draw(pos)
+                pygame.display.flip()
+                changed = False
+
+    def __add_to_trail(self, pos):
+        self.__trail.append(pos)
+        self.__trail_ys.append(pos[1])
+
+    def __draw(self, pos):
+        # everything inside the view and nothing else, so a frame costs the same
+        # however many lanes and rungs the ladder has
+        view = self.__view
+        self.__window.fill(WHITE)
+
+        # lanes whose line or labels reach into the view
+        first = min(max(int(view.left // MARGIN_LEFT) - 2, 0), self.__results_len)
+        end = min(max(int(view.right // MARGIN_LEFT) + 1, 0), self.__results_len)
+        for v in self.__verticals[first:end]:
+            v.draw(self.__window, view)
+
+        # rungs in the view, found by y and then by lane
+        ys = self.__ladder.ys
+        lefts = self.__ladder.lefts
+        width = view.scale(LINE_WIDTH)
+        low = bisect.bisect_left(ys, view.top - MARGIN_TOP - LINE_WIDTH)
+        high = bisect.bisect_right(ys, view.bottom - MARGIN_TOP + LINE_WIDTH)
+        for index in range(low, high):
+            left = lefts[index]
+            if first - 1 <= left < end:
+                rung_y = MARGIN_TOP + ys[index]
+                start_pos = view.to_screen((MARGIN_LEFT * (left + 1), rung_y))
+                end_pos = view.to_screen((MARGIN_LEFT * (left + 2), rung_y))
+                pygame.draw.line(self.__window, BLACK, start_pos, end_pos, width)
+
+        # the trail from the corner just above the view to the dot
+        low = max(bisect.bisect_left(self.__trail_ys, view.top) - 1, 0)
+        high = bisect.bisect_right(self.__trail_ys, view.bottom) + 1
+        points = [view.to_screen(point) for point in self.__trail[low:high]]
+        points.append(view.to_screen(pos))
+        if len(points) > 1:
+            pygame.draw.lines(self.__window, RED, False, points, view.scale(3))
+
+        self.__cover(pos[1])
+
+        # draw current circle
+        pygame.draw.circle(self.__window, RED, view.to_screen(pos), view.scale(5))
 
     def __cover(self, current_y):
-        rect_top = (MARGIN_TOP / 6) + current_y
-        rect_height = self.__height + MARGIN_TOP - rect_top
-        pygame.draw.rect(self.__window, BLACK, (0, rect_top, self.__window_width, rect_height))
+        # hide the ladder below the dot
+        view = self.__view
+        rect_left, rect_top = view.to_screen((0, (MARGIN_TOP / 6) + current_y))
+        rect_right, rect_bottom = view.to_screen((self.__world_width, self.__height + MARGIN_TOP))
+        rect_left, rect_top = max(rect_left, 0), max(rect_top, 0)
+        rect_right, rect_bottom = min(rect_right, self.__window_width), min(rect_bottom, self.__window_height)
+        if rect_top < rect_bottom:
+            pygame.draw.rect(self.__window, BLACK, (rect_left, rect_top, rect_right - rect_left, rect_bottom - rect_top))
+
+def print_mapping(ladder, results):
+    for start, end in enumerate(ladder.permutation()):
+        print(f"{lane_name(start)} -> {results[end]}")
+
+def save_ladder(path, ladder, results, start):
+    names = '\n'.join(results).encode()
+    names += bytes(-len(names) % 4)
+    ys = array('i', ladder.ys)
+    lefts = array('H', ladder.lefts)
+    if sys.byteorder == 'big':
+        ys.byteswap()
+        lefts.byteswap()
+    with open(path, 'wb') as file:
+        file.write(LADDER_HEADER.pack(LADDER_MAGIC, LADDER_VERSION, ladder.lanes, ladder.height, start, len(ys), len(names)))
+        file.write(names)
+        file.write(ys.tobytes())
+        file.write(lefts.tobytes())
+
+def load_ladder(path):
+    # maps the file and reads the rungs straight out of it, so opening a ladder
+    # costs the same however many rungs it has; returns (ladder, results, start)
+    with open(path, 'rb') as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(data) < LADDER_HEADER.size:
+        raise ValueError(f'{path}: not a saved ladder')
+    magic, version, lanes, height, start, rungs, names = LADDER_HEADER.unpack_from(data)
+    if magic != LADDER_MAGIC or version != LADDER_VERSION:
+        raise ValueError(f'{path}: not a saved ladder')
+    offset = LADDER_HEADER.size + names
+    if len(data) != offset + rungs * 6:
+        raise ValueError(f'{path}: truncated ladder')
+
+    results = data[LADDER_HEADER.size:offset].rstrip(b'\0').decode().split('\n')
+    view = memoryview(data)
+    ys = view[offset:offset + rungs * 4].cast('i')
+    lefts = view[offset + rungs * 4:].cast('H')
+    if sys.byteorder == 'big':
+        ys, lefts = array('i', ys), array('H', lefts)
+        ys.byteswap()
+        lefts.byteswap()
+    return Ladder(lanes, height, ys, lefts), results, start
+
+def generate_permutations(rng, count, lanes, height, probability=RUNG_PROBABILITY, spacing=RUNG_SPACING):
+    # Ladder.__generate for count ladders at once: every step places the next rung
+    # of each ladder still above the end and swaps its two lanes straight away.
+    # Returns the start lane sitting on every end lane, one row per ladder.
+    starts = np.tile(np.arange(lanes, dtype=np.int32), (count, 1))
+    slots = lanes - 1
+    if slots < 1:
+        return starts
+
+    end = height - LINE_WIDTH
+    rows = np.arange(count)
+    y = np.full(count, LINE_WIDTH, dtype=np.int64)
+    i = np.zeros(count, dtype=np.int64)
+    while rows.size:
+        i += rng.geometric(probability, rows.size) - 1
+        y += i // slots
+        i %= slots
+        live = y < end
+        if not live.all():
+            rows, y, i = rows[live], y[live], i[live]
+
+        left = starts[rows, i]
+        starts[rows, i] = starts[rows, i + 1]
+        starts[rows, i + 1] = left
+
+        i += 2
+        y += spacing
+        wrap = i >= slots
+        i[wrap] = 0
+        y[wrap] += 1
+    return starts
+
+def count_outcomes(job):
+    # start x result frequencies of one batch of random ladders
+    seed, count, lanes, height, probability, spacing = job
+    starts = generate_permutations(np.random.default_rng(seed), count, lanes, height, probability, spacing)
+    cells = starts * lanes + np.arange(lanes)
+    return np.bincount(cells.ravel(), minlength=lanes * lanes).reshape(lanes, lanes)
+
+def chi_square(counts):
+    # against every start being equally likely to reach every result; rows and
+    # columns each add up to the number of ladders, hence (lanes - 1)^2 degrees
+    # of freedom. The p-value uses the Wilson-Hilferty normal approximation.
+    lanes = len(counts)
+    expected = counts.sum() / (lanes * lanes)
+    statistic = float(((counts - expected) ** 2 / expected).sum())
+    freedom = (lanes - 1) ** 2
+    spread = 2 / (9 * freedom)
+    z = ((statistic / freedom) ** (1 / 3) - (1 - spread)) / math.sqrt(spread)
+    return statistic, freedom, 0.5 * math.erfc(z / math.sqrt(2))
+
+def analyze(lanes, height, ladders, probabilities, spacings, workers, batch=100000, seed=None):
+    seeds = np.random.SeedSequence(seed)
+    summary = []
+    with multiprocessing.Pool(workers) as pool:
+        for probability in probabilities:
+            for spacing in spacings:
+                sizes = [batch] * (ladders // batch) + ([ladders % batch] if ladders % batch else [])
+                jobs = [(child, size, lanes, height, probability, spacing) for child, size in zip(seeds.spawn(len(sizes)), sizes)]
+                started = time.perf_counter()
+                counts = sum(pool.imap_unordered(count_outcomes, jobs))
+                elapsed = time.perf_counter() - started
+                statistic, freedom, p = chi_square(counts)
+
+                print(f'probability {probability}, spacing {spacing}px: {ladders:,} ladders of {lanes} lanes x {height}px')
+                print('start x result frequency, 1.00 = uniform:')
+                print('     ' + ''.join(f'{result:>6}' for result in range(lanes)))
+                for start, row in enumerate(counts):
+                    print(f'{lane_name(start):>5}' + ''.join(f'{cell * lanes / ladders:6.2f}' for cell in row))
+                print(f'chi-square {statistic:,.1f} on {freedom} dof, p = {p:.3g}')
+                print(f'{ladders / elapsed:,.0f} ladders/s on {workers} workers\n')
+                summary.append((probability, spacing, statistic, freedom, p, ladders / elapsed))
+
+    if len(summary) > 1:
+        print(f'{"probability":>11} {"spacing":>7} {"chi-square":>12} {"dof":>5} {"p":>9} {"ladders/s":>12}')
+        for probability, spacing, statistic, freedom, p, rate in summary:
+            print(f'{probability:>11} {spacing:>7} {statistic:>12,.1f} {freedom:>5} {p:>9.3g} {rate:>12,.0f}')
 
 if __name__ == '__main__':
-    if len(sys.argv) < 4:
+    parser = argparse.ArgumentParser(usage='python amidakuji.py [--headless] [--seed N] [--save FILE] <result1> <result2> [<result3> ...] <height_px>\n'
+                                           '       python amidakuji.py [--headless] --replay FILE')
+    parser.add_argument('results', nargs='*', help='the results, then the height in px')
+    parser.add_argument('--seed', type=int, help='seed for the rungs and the starting lane, to reproduce a draw')
+    parser.add_argument('--save', metavar='FILE', help='save the ladder and starting lane')
+    parser.add_argument('--replay', metavar='FILE', help='animate a saved ladder again')
+    parser.add_argument('--speed', type=float, default=SPEED, help='animation speed in px/s, hold space to fast-forward')
+    parser.add_argument('--duration', type=float, default=DURATION, help='longest the animation may take in seconds, however tall the ladder')
+    parser.add_argument('--headless', action='store_true', help='print where every lane ends up instead of animating')
+    parser.add_argument('--analyze', type=int, metavar='LADDERS', help='check how uniform the results of this many random ladders are')
+    parser.add_argument('--probability', type=float, nargs='+', default=[RUNG_PROBABILITY], help='rung probabilities to analyze')
+    parser.add_argument('--spacing', type=int, nargs='+', default=[RUNG_SPACING], help='rung spacings (px) to analyze')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='analysis worker processes')
+    args = parser.parse_args()
+    # the height is the last positional, and only there without --replay
+    args.height = None
+    if args.results and not args.replay:
+        try:
+            args.height = int(args.results.pop())
+        except ValueError:
+            parser.error('the last argument must be the height in px')
+
+    if args.replay:
+        try:
+            ladder, args.results, start = load_ladder(args.replay)
+        except (OSError, ValueError) as error:
+            print(f'ERROR: {error}')
+            sys.exit(1)
+        args.height = ladder.height
+    elif len(args.results) < 2 or args.height is None:
         print('ERROR: Not enough arguments!')
-        print('Usage: python amidakuji.py <result1> <result2> [<result3> ...] <height_px>')
+        parser.print_usage()
         sys.exit(1)
 
+    if args.analyze:
+        if np is None:
+            print('ERROR: numpy is required for --analyze')
+            sys.exit(1)
+        analyze(len(args.results), args.height, args.analyze, args.probability, args.spacing, args.workers, seed=args.seed)
+        sys.exit(0)
+
+    if not args.replay:
+        rng = random.Random(args.seed)
+        ladder = Ladder(len(args.results), args.height, rng=rng)
+        start = rng.randint(0, len(args.results) - 1)
+        if args.save:
+            save_ladder(args.save, ladder, args.results, start)
+
+    if args.headless:
+        print_mapping(ladder, args.results)
+        sys.exit(0)
+
     pygame.init()
-    game = Game()
+    game = Game(args.results, args.height, ladder, start, speed=args.speed, duration=args.duration)
     game.start()
     sys.exit(0)
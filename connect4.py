@@ -1,66 +1,105 @@
 import pygame
+import argparse
+import functools
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import threading
 import time
 from dataclasses import dataclass
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 def p2c(col, row):
     x = ((Coin.LEFT_GAP + Coin.DIAMETER) * col) - (Board.MARGIN_SIDE / 2)
     y = ((Coin.TOP_GAP + Coin.DIAMETER) * row) + (Board.MARGIN_TOP / 1.5)
     return x, y
 
-def isDiagonalWin(slot):
-    return False
+def countLine(board, side, row, col, drow, dcol):
+    """Number of side's coins next to (row, col), walking away from it in (drow, dcol).
 
-def isVerticalWin(slot):
-    if slot.coin.color == Color.WHITE:
-        return False
+    Stops after connect - 1 coins, so a check costs O(connect) on any board size.
+    """
+    count = 0
+    row += drow
+    col += dcol
+    while (count < board.connect - 1 and 0 <= row < board.rows and 0 <= col < board.columns
+           and board.owner(row, col) == side):
+        count += 1
+        row += drow
+        col += dcol
+    return count
 
-    count = 1
-    for row in range(slot.position.row + 1, Board.ROWS):
-        if board.rows[row][slot.position.col].coin.color == slot.coin.color:
-            count += 1
-            if count == 4:
-                return True
-        else:
-            break
+def isVerticalWin(board, side, row, col):
+    # nothing can sit above the coin that was just dropped
+    return 1 + countLine(board, side, row, col, 1, 0) >= board.connect
+
+def isHorizontalWin(board, side, row, col):
+    return 1 + countLine(board, side, row, col, 0, -1) + countLine(board, side, row, col, 0, 1) >= board.connect
 
+def isDiagonalWin(board, side, row, col):
+    for drow, dcol in ((1, 1), (1, -1)):
+        if 1 + countLine(board, side, row, col, drow, dcol) + countLine(board, side, row, col, -drow, -dcol) >= board.connect:
+            return True
     return False
 
-def isHorizontalWin(slot):
-    if slot.position.col + 4 >= Board.COLUMNS:
-        return False
-    
-    if slot.coin.color == Color.WHITE:
-        return False
+def isGameOver(board, col):
+    """Whether the coin just dropped into col completes a line through it."""
+    row = board.top(col)
+    side = board.owner(row, col)
+    return (isVerticalWin(board, side, row, col)
+            or isHorizontalWin(board, side, row, col)
+            or isDiagonalWin(board, side, row, col))
 
-    count = 1
-    for row in board.rows:
-        for col in range(slot.position.col, slot.position.col + 4):
-            if slot.coin.color == row[col].coin.color:
-                count += 1
-                if count >= 4:
-                    return True
-            else:
-                count = 1
-                break
-    return False
+def toTensor(boards):
+    """(N, ROWS, COLUMNS) int8 array of boards: 0 empty, 1 or 2 for a coin of side 0 or 1."""
+    masks = np.array([board.masks for board in boards], dtype=np.uint64)
+    bits = (masks[:, :, None] >> np.arange(Board.STRIDE * Board.COLUMNS, dtype=np.uint64)) & np.uint64(1)
+    # (N, side, col, height) without the sentinel bit of each column
+    bits = bits.reshape(len(masks), 2, Board.COLUMNS, Board.STRIDE)[:, :, :, :Board.ROWS].astype(np.int8)
+    cells = bits[:, 0] + bits[:, 1] * 2
+    # height counts from the bottom, rows from the top
+    return np.ascontiguousarray(cells.transpose(0, 2, 1)[:, ::-1, :])
 
-def isGameOver():
-    for columns in board.rows:
-        for slot in columns:
-            if isHorizontalWin(slot) or isVerticalWin(slot) or isDiagonalWin(slot):
-                return True
-    return False
+def batchWinners(cells, connect=None):
+    """Side owning a line on every board of a toTensor array, or -1; side 0 wins ties."""
+    connect = connect or Board.CONNECT
+    count, rows, cols = cells.shape
+    span = connect - 1
+    # boards on the last axis, so every window slice below is a contiguous run of boards
+    cells = np.ascontiguousarray(cells.transpose(1, 2, 0))
+    winners = np.full(count, -1, dtype=np.int8)
+    for side in (1, 0):
+        own = (cells == side + 1).view(np.int8)
+        lines = np.zeros(count, dtype=bool)
+        for drow, dcol in ((0, 1), (1, 0), (1, 1), (1, -1)):
+            height = rows - span * drow
+            width = cols - span * abs(dcol)
+            if height <= 0 or width <= 0:
+                continue
+            # sum of the CONNECT cells of every window starting inside height x width
+            total = np.zeros((height, width, count), dtype=np.int8)
+            for step in range(connect):
+                row = step * drow
+                col = step * dcol + (span if dcol < 0 else 0)
+                total += own[row:row + height, col:col + width]
+            lines |= (total == connect).any(axis=(0, 1))
+        winners[lines] = side
+    return winners
 
 class Player:
-    def __init__(self, color):
+    def __init__(self, color, side):
         self.color = color
+        self.side = side
 
-    def putCoin(self, col):
-        for row in range(Board.ROWS - 1, -1, -1):
-            if board.rows[row][col].coin.color == Color.WHITE:
-                board.rows[row][col].coin.color = self.color
-                return True
-        return False
+    def putCoin(self, board, col):
+        return board.play(col, self.side)
 
 @dataclass
 class Position:
@@ -71,7 +110,7 @@ class Position:
 class Window:
     WIDTH = 900
     HEIGHT = 700
-    FPS = 10
+    FPS = 60
 
 @dataclass
 class Color:
@@ -92,25 +131,139 @@ class Board:
 
     ROWS = 6
     COLUMNS = 7
+    CONNECT = 4
+    # Bits per column: ROWS cells plus an always-empty sentinel bit on top,
+    # so shifted masks never carry a line over into the next column.
+    STRIDE = ROWS + 1
+    # lowest bit of every column, and every playable (non-sentinel) bit
+    BOTTOM = ((1 << (STRIDE * COLUMNS)) - 1) // ((1 << STRIDE) - 1)
+    CELLS = BOTTOM * ((1 << ROWS) - 1)
 
     def __init__(self):
-        self.rows = []
-        for row in range(Board.ROWS):
-            self.rows.append([])
-            for col in range(Board.COLUMNS):
-                self.rows[row].append(Slot(Position(row, col), coin=Coin(col, row, Color.WHITE)))
-
-    def draw(self):
-        pygame.draw.rect(screen,
-                        Color.BLUE,
-                        (Board.MARGIN_SIDE,
-                        Board.MARGIN_TOP,
-                        Board.WIDTH,
-                        Board.HEIGHT))
+        self.rows = Board.ROWS
+        self.columns = Board.COLUMNS
+        self.connect = Board.CONNECT
+        # masks[side] has bit (col * STRIDE + height) set for each coin of that side
+        self.masks = [0, 0]
+        # bit index of the next free cell in every column
+        self.heights = [col * Board.STRIDE for col in range(Board.COLUMNS)]
+        self.moves = []
 
-        for columns in self.rows:
-            for slot in columns:
-                slot.coin.draw()
+    def canPlay(self, col):
+        return self.heights[col] < col * Board.STRIDE + Board.ROWS
+
+    def play(self, col, side):
+        if not self.canPlay(col):
+            return False
+        self.masks[side] |= 1 << self.heights[col]
+        self.heights[col] += 1
+        self.moves.append(col)
+        return True
+
+    def undo(self):
+        col = self.moves.pop()
+        self.heights[col] -= 1
+        keep = ~(1 << self.heights[col])
+        self.masks[0] &= keep
+        self.masks[1] &= keep
+
+    def isWin(self, side):
+        mask = self.masks[side]
+        # vertical, diagonal /, horizontal, diagonal \
+        for shift in (1, Board.STRIDE - 1, Board.STRIDE, Board.STRIDE + 1):
+            pairs = mask & (mask >> shift)
+            if pairs & (pairs >> (shift * 2)):
+                return True
+        return False
+
+    def threats(self, side):
+        """Empty cells that would complete a line for side if it got a coin there."""
+        own = self.masks[side]
+        cells = (own << 1) & (own << 2) & (own << 3)
+        for shift in (Board.STRIDE - 1, Board.STRIDE, Board.STRIDE + 1):
+            pair = (own << shift) & (own << (shift * 2))
+            cells |= pair & (own << (shift * 3))
+            cells |= pair & (own >> shift)
+            pair = (own >> shift) & (own >> (shift * 2))
+            cells |= pair & (own << shift)
+            cells |= pair & (own >> (shift * 3))
+        return cells & Board.CELLS & ~(self.masks[0] | self.masks[1])
+
+    def key(self, side):
+        """Unique number for this position with side to move."""
+        return self.masks[side] + (self.masks[0] | self.masks[1]) + Board.BOTTOM
+
+    def copy(self):
+        board = Board()
+        board.masks = list(self.masks)
+        board.heights = list(self.heights)
+        board.moves = list(self.moves)
+        return board
+
+    def isFull(self):
+        return len(self.moves) == Board.ROWS * Board.COLUMNS
+
+    def top(self, col):
+        """Row of the highest coin in col (row 0 is the top of the board)."""
+        return Board.ROWS - (self.heights[col] - col * Board.STRIDE)
+
+    def owner(self, row, col):
+        # row 0 is the top of the board, bits count up from the bottom
+        bit = 1 << (col * Board.STRIDE + Board.ROWS - 1 - row)
+        if self.masks[0] & bit:
+            return 0
+        if self.masks[1] & bit:
+            return 1
+        return None
+
+class SparseBoard:
+    """Board of any size and line length that stores only the occupied cells.
+
+    Memory and the cost of a move grow with the coins played, not with the
+    board area, so variants like 50x50 with 5 in a row cost the same per move
+    as the classic board. Search and the opening book need the bitboard.
+    """
+
+    def __init__(self, rows, columns, connect):
+        self.rows = rows
+        self.columns = columns
+        self.connect = connect
+        # side of every coin by (col, height above the bottom)
+        self.cells = {}
+        # coins in every non-empty column
+        self.heights = {}
+        self.moves = []
+
+    def canPlay(self, col):
+        return 0 <= col < self.columns and self.heights.get(col, 0) < self.rows
+
+    def play(self, col, side):
+        if not self.canPlay(col):
+            return False
+        height = self.heights.get(col, 0)
+        self.cells[(col, height)] = side
+        self.heights[col] = height + 1
+        self.moves.append(col)
+        return True
+
+    def undo(self):
+        col = self.moves.pop()
+        height = self.heights[col] - 1
+        del self.cells[(col, height)]
+        if height:
+            self.heights[col] = height
+        else:
+            del self.heights[col]
+
+    def isFull(self):
+        return len(self.moves) == self.rows * self.columns
+
+    def top(self, col):
+        """Row of the highest coin in col (row 0 is the top of the board)."""
+        return self.rows - self.heights[col]
+
+    def owner(self, row, col):
+        return self.cells.get((col, self.rows - 1 - row))
 
 @dataclass
 class Coin:
@@ -120,83 +273,747 @@ class Coin:
     TOP_GAP = int((Board.HEIGHT - (Board.ROWS * RADIUS  * 2)) / (Board.ROWS + 1))
     LEFT_GAP = int((Board.WIDTH - (Board.COLUMNS * RADIUS  * 2)) / (Board.COLUMNS + 1))
 
+    sprites = {}
+
     def __init__(self, col, row, color):
         self.col = col + 1
         self.row = row + 1
         self.color = color
 
-    def draw(self):
-        pygame.draw.circle(screen,
-                         self.color,
-                         p2c(self.col, self.row),
-                         self.RADIUS)
-        pygame.draw.circle(screen,
-                    Color.BLACK,
-                    p2c(self.col, self.row),
-                    self.RADIUS, 4)
+    @staticmethod
+    def sprite(color):
+        """Coin of color rendered once, then blitted wherever it is needed."""
+        if color not in Coin.sprites:
+            sprite = pygame.Surface((Coin.DIAMETER + 1, Coin.DIAMETER + 1), pygame.SRCALPHA)
+            pygame.draw.circle(sprite, color, (Coin.RADIUS, Coin.RADIUS), Coin.RADIUS)
+            pygame.draw.circle(sprite, Color.BLACK, (Coin.RADIUS, Coin.RADIUS), Coin.RADIUS, 4)
+            Coin.sprites[color] = sprite
+        return Coin.sprites[color]
+
+    def draw(self, screen):
+        sprite = Coin.sprite(self.color)
+        return screen.blit(sprite, sprite.get_rect(center=p2c(self.col, self.row)))
 
 @dataclass
 class Slot:
     position: Position
     coin: Coin | None
 
+class BoardView:
+    """Board pre-rendered to a cached surface; afterwards only slots that change are painted.
+
+    At most Board.COLUMNS x Board.ROWS slots are shown. Larger boards scroll,
+    and only the visible slots are ever drawn.
+    """
+
+    def __init__(self, screen, board):
+        self.screen = screen
+        self.background = pygame.Surface(screen.get_size())
+        self.columns = min(board.columns, Board.COLUMNS)
+        self.rows = min(board.rows, Board.ROWS)
+        # board column and row shown in the top left slot, starting at the bottom where coins land
+        self.left = 0
+        self.top = board.rows - self.rows
+
+    def follow(self, col, row=None):
+        """Scroll just enough to show col (and row); whether the view moved."""
+        shown = (self.left, self.top)
+        self.left = min(max(self.left, col - self.columns + 1), col)
+        if row is not None:
+            self.top = min(max(self.top, row - self.rows + 1), row)
+        return shown != (self.left, self.top)
+
+    def scroll(self, board, rows):
+        """Scroll up (negative) or down by rows; whether the view moved."""
+        top = self.top
+        self.top = min(max(self.top + rows, 0), board.rows - self.rows)
+        return top != self.top
+
+    def render(self, board, players):
+        """Paint the whole board from scratch; returns the dirty rect."""
+        self.background.fill(Color.WHITE)
+        pygame.draw.rect(self.background,
+                        Board.COLOR,
+                        (Board.MARGIN_SIDE,
+                        Board.MARGIN_TOP,
+                        Board.WIDTH,
+                        Board.HEIGHT))
+
+        for row in range(self.rows):
+            for col in range(self.columns):
+                side = board.owner(self.top + row, self.left + col)
+                Coin(col, row, Color.WHITE if side is None else players[side].color).draw(self.background)
+        return self.screen.blit(self.background, (0, 0))
+
+    def drop(self, board, col, color):
+        """Paint the coin just dropped into col, which must be in view; returns the dirty rect."""
+        rect = Coin(col - self.left, board.top(col) - self.top, color).draw(self.background)
+        return self.screen.blit(self.background, rect, rect)
+
 class Cursor:
     HEIGHT = 30
     WIDTH = 55
 
-    def __init__(self):
+    def __init__(self, columns=Board.COLUMNS):
+        self.columns = columns
         self.col = 0
         self.x, _ = p2c(self.col, 0)
         self.y = Board.MARGIN_TOP - Cursor.HEIGHT
+        # what is on screen now: (x, colour) and the area it covers
+        self.drawn = None
+        self.rect = None
 
-    def draw(self):
-        pygame.draw.polygon(
-            screen,
-            players[0 if myTurn else 1].color,
-            (
-                (self.x + (Cursor.WIDTH / 2) + Coin.DIAMETER, self.y - Cursor.HEIGHT),
-                (self.x + (Cursor.WIDTH * 1.5) + Coin.DIAMETER, self.y - Cursor.HEIGHT),
-                (self.x + Cursor.WIDTH + Coin.DIAMETER, self.y)
-            )
-        )
+    def draw(self, screen, background, color, left=0):
+        """Overlay the cursor over a view scrolled to column left if it moved or changed colour.
+
+        Returns the dirty rects.
+        """
+        self.x, _ = p2c(self.col - left, 0)
+        if self.drawn == (self.x, color):
+            return []
 
-        pygame.draw.polygon(
-            screen,
-            Color.BLACK,
-            (
-                (self.x + (Cursor.WIDTH / 2) + Coin.DIAMETER, self.y - Cursor.HEIGHT),
-                (self.x + (Cursor.WIDTH * 1.5) + Coin.DIAMETER, self.y - Cursor.HEIGHT),
-                (self.x + Cursor.WIDTH + Coin.DIAMETER, self.y)
-            ),
-            4
+        dirty = []
+        if self.rect is not None:
+            dirty.append(screen.blit(background, self.rect, self.rect))
+
+        points = (
+            (self.x + (Cursor.WIDTH / 2) + Coin.DIAMETER, self.y - Cursor.HEIGHT),
+            (self.x + (Cursor.WIDTH * 1.5) + Coin.DIAMETER, self.y - Cursor.HEIGHT),
+            (self.x + Cursor.WIDTH + Coin.DIAMETER, self.y)
         )
+        rect = pygame.draw.polygon(screen, color, points)
+        self.rect = rect.union(pygame.draw.polygon(screen, Color.BLACK, points, 4))
+        self.drawn = (self.x, color)
+        dirty.append(self.rect)
+        return dirty
 
     def left(self):
         self.col = self.col - 1 if self.col > 0 else 0
-        self.x, _ = p2c(self.col, 0)
 
     def right(self):
-        self.col = self.col + 1 if self.col < Board.COLUMNS - 1 else Board.COLUMNS - 1
-        self.x, _ = p2c(self.col, 0)
+        self.col = self.col + 1 if self.col < self.columns - 1 else self.columns - 1
+
+class SearchTimeout(Exception):
+    pass
+
+class TranspositionTable:
+    """Fixed number of slots indexed by position key, so memory stays bounded.
+
+    A slot is overwritten by a result from a newer search, or from the same
+    search when the new result was searched at least as deep.
+    """
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+    def __init__(self, bits=16):
+        self.shift = 64 - bits
+        self.slots = [None] * (1 << bits)
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+
+    def index(self, key):
+        # Fibonacci hashing: the top bits of the product depend on every key bit,
+        # the low bits of a key only describe the leftmost columns
+        return ((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> self.shift
+
+    def peek(self, key):
+        entry = self.slots[self.index(key)]
+        return entry if entry is not None and entry[0] == key else None
+
+    def get(self, key):
+        self.probes += 1
+        entry = self.peek(key)
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def put(self, key, depth, flag, score, move):
+        index = self.index(key)
+        entry = self.slots[index]
+        if entry is None or entry[0] == key or entry[5] != self.generation or depth >= entry[1]:
+            self.slots[index] = (key, depth, flag, score, move, self.generation)
+
+class Search:
+    """Negamax with alpha-beta pruning and iterative deepening under a time budget."""
+    WIN = 1000
+    # centre columns take part in the most lines, so they are tried first
+    ORDER = sorted(range(Board.COLUMNS), key=lambda col: abs(col - Board.COLUMNS // 2))
+    CENTRE = ((1 << Board.ROWS) - 1) << (Board.COLUMNS // 2 * Board.STRIDE)
+
+    def __init__(self, budget=0.5, table=None, book=None):
+        self.budget = budget
+        self.table = table if table is not None else TranspositionTable()
+        self.book = book
+        self.fromBook = False
+        self.solved = False
+        self.deadline = 0
+        self.nodes = 0
+        self.depth = 0
+        self.score = 0
+        self.elapsed = 0
+
+    def bestMove(self, board, side):
+        """Column to play for side; board is restored before returning."""
+        start = time.perf_counter()
+        self.deadline = start + self.budget
+        self.nodes = 0
+        self.table.probes = self.table.hits = 0
+        self.table.generation += 1
+        plies = len(board.moves)
+
+        # a proven book entry is final; any other only stands in for a live
+        # search that cannot get as deep as the book's did
+        entry = self.book.lookup(board.key(side)) if self.book is not None else None
+        self.fromBook = False
+        if entry is not None and entry[2] == OpeningBook.SOLVED:
+            return self.useBook(entry, start)
+
+        move = next(col for col in Search.ORDER if board.canPlay(col))
+        self.depth = self.score = 0
+        self.solved = False
+        remaining = Board.ROWS * Board.COLUMNS - plies
+        try:
+            for depth in range(1, remaining + 1):
+                score, col = self.root(board, side, depth)
+                move, self.depth, self.score = col, depth, score
+                if abs(score) >= Search.WIN - Board.ROWS * Board.COLUMNS or depth == remaining:
+                    self.solved = True
+                    break  # forced result or the whole game searched, deeper cannot change it
+        except SearchTimeout:
+            while len(board.moves) > plies:
+                board.undo()
+        if entry is not None and not self.solved and self.depth <= entry[2]:
+            return self.useBook(entry, start)
+        self.elapsed = time.perf_counter() - start
+        return move
+
+    def useBook(self, entry, start):
+        move, self.score, self.depth = entry
+        self.fromBook = True
+        self.solved = self.depth == OpeningBook.SOLVED
+        self.elapsed = time.perf_counter() - start
+        return move
+
+    def root(self, board, side, depth):
+        best, bestCol = -Search.WIN - 1, None
+        alpha = -Search.WIN - 1
+        for col in self.ordered(board, side):
+            board.play(col, side)
+            if board.isWin(side):
+                score = Search.WIN - len(board.moves)
+            else:
+                score = -self.negamax(board, 1 - side, depth - 1, -Search.WIN - 1, -alpha)
+            board.undo()
+            if score > best:
+                best, bestCol = score, col
+                alpha = max(alpha, score)
+        self.table.put(board.key(side), depth, TranspositionTable.EXACT, best, bestCol)
+        return best, bestCol
+
+    def ordered(self, board, side, first=None):
+        cols = [col for col in Search.ORDER if board.canPlay(col)]
+        if first is None:
+            entry = self.table.peek(board.key(side))
+            if entry is not None:
+                first = entry[4]
+        if first in cols:
+            cols.remove(first)
+            cols.insert(0, first)
+        return cols
+
+    def negamax(self, board, side, depth, alpha, beta):
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        if board.isFull():
+            return 0
+        if depth == 0:
+            return self.evaluate(board, side)
+
+        key = board.key(side)
+        origin = alpha
+        first = None
+        entry = self.table.get(key)
+        if entry is not None:
+            _, entryDepth, flag, score, first, _ = entry
+            if entryDepth >= depth:
+                if flag == TranspositionTable.EXACT:
+                    return score
+                if flag == TranspositionTable.LOWER:
+                    alpha = max(alpha, score)
+                else:
+                    beta = min(beta, score)
+                if alpha >= beta:
+                    return score
+
+        best, bestCol = -Search.WIN - 1, None
+        for col in self.ordered(board, side, first):
+            board.play(col, side)
+            if board.isWin(side):
+                # scored by coins on the board, so the value only depends on the position
+                score = Search.WIN - len(board.moves)
+            else:
+                score = -self.negamax(board, 1 - side, depth - 1, -beta, -alpha)
+            board.undo()
+            if score > best:
+                best, bestCol = score, col
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+
+        if best <= origin:
+            flag = TranspositionTable.UPPER
+        elif best >= beta:
+            flag = TranspositionTable.LOWER
+        else:
+            flag = TranspositionTable.EXACT
+        self.table.put(key, depth, flag, best, bestCol)
+        return best
+
+    def evaluate(self, board, side):
+        threats = board.threats(side).bit_count() - board.threats(1 - side).bit_count()
+        centre = (board.masks[side] & Search.CENTRE).bit_count() - (board.masks[1 - side] & Search.CENTRE).bit_count()
+        return threats * 4 + centre
+
+    def report(self):
+        if self.fromBook:
+            if self.solved:
+                return f'opening book score {self.score}, proven'
+            return f'opening book score {self.score} at depth {self.depth}'
+        nps = self.nodes / self.elapsed if self.elapsed else 0
+        hitRate = self.table.hits / self.table.probes if self.table.probes else 0
+        return (f'depth {self.depth} score {self.score} nodes {self.nodes} '
+                f'({nps:,.0f} nodes/s) table hit rate {hitRate:.0%}')
+
+class OpeningBook:
+    """Sorted (key, move, score, depth) records read through mmap and found by binary search.
+
+    The file starts with HEADER (magic, board size, record count) followed by
+    fixed-size RECORDs sorted by Board.key, so a lookup touches only the
+    pages on its search path. depth is how deep the search behind a record
+    went, or SOLVED when its score is proven.
+    """
+    MAGIC = b'C4B2'
+    HEADER = struct.Struct('<4sBBBI')
+    RECORD = struct.Struct('<QbhB')
+    SOLVED = 255
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, rows, cols, connect, self.count = OpeningBook.HEADER.unpack_from(self.data)
+        if magic != OpeningBook.MAGIC or (rows, cols, connect) != (Board.ROWS, Board.COLUMNS, Board.CONNECT):
+            raise ValueError(f'{path} is not an opening book for {Board.COLUMNS}x{Board.ROWS} connect {Board.CONNECT}')
+
+    def lookup(self, key):
+        """(move, score, depth) stored for key, or None."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry, move, score, depth = OpeningBook.RECORD.unpack_from(
+                self.data, OpeningBook.HEADER.size + middle * OpeningBook.RECORD.size)
+            if entry == key:
+                return move, score, depth
+            if entry < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    @staticmethod
+    def write(path, entries):
+        """Write {key: (move, score, depth)} as a book, replacing path only once complete."""
+        with open(path + '.tmp', 'wb') as file:
+            file.write(OpeningBook.HEADER.pack(OpeningBook.MAGIC, Board.ROWS, Board.COLUMNS, Board.CONNECT, len(entries)))
+            for key in sorted(entries):
+                file.write(OpeningBook.RECORD.pack(key, *entries[key]))
+        os.replace(path + '.tmp', path)
+
+@functools.cache
+def loadBook(path):
+    """One open OpeningBook per path and process."""
+    return OpeningBook(path) if path else None
+
+def openings(plies):
+    """Move lists of every distinct position with at most plies coins and no line yet."""
+    board = Board()
+    seen = {}
+
+    def visit(side):
+        key = board.key(side)
+        if key in seen:
+            return
+        seen[key] = list(board.moves)
+        if len(board.moves) == plies:
+            return
+        for col in range(Board.COLUMNS):
+            if board.play(col, side):
+                if not board.isWin(side):
+                    visit(1 - side)
+                board.undo()
+
+    visit(0)
+    return list(seen.values())
+
+def solveOpening(job):
+    """Search one opening position; returns (key, move, score, depth), depth SOLVED if proven."""
+    moves, budget = job
+    board = Board()
+    for ply, col in enumerate(moves):
+        board.play(col, ply % 2)
+    side = len(moves) % 2
+    search = Search(budget)
+    move = search.bestMove(board, side)
+    return board.key(side), move, search.score, OpeningBook.SOLVED if search.solved else search.depth
+
+def buildBook(path, plies, workers, budget):
+    """Search every opening up to plies coins on a process pool and write the book to path.
+
+    Solved positions are appended to '<path>.partial' as they arrive, so an
+    interrupted build picks up where it stopped.
+    """
+    partial = path + '.partial'
+    entries = {}
+    if os.path.exists(partial):
+        with open(partial) as file:
+            for line in file:
+                key, move, score, depth = map(int, line.split())
+                entries[key] = (move, score, depth)
+
+    jobs = []
+    for moves in openings(plies):
+        board = Board()
+        for ply, col in enumerate(moves):
+            board.play(col, ply % 2)
+        if board.key(len(moves) % 2) not in entries:
+            jobs.append((moves, budget))
+    print(f'{len(entries)} positions already solved, {len(jobs)} to go')
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool, open(partial, 'a') as file:
+        for done, (key, move, score, depth) in enumerate(pool.imap_unordered(solveOpening, jobs), 1):
+            entries[key] = (move, score, depth)
+            file.write(f'{key} {move} {score} {depth}\n')
+            file.flush()
+            if done % 1000 == 0:
+                print(f'{done}/{len(jobs)} solved, {done / (time.perf_counter() - start):,.1f} positions/s')
+
+    OpeningBook.write(path, entries)
+    os.remove(partial)
+    solved = sum(depth == OpeningBook.SOLVED for _, _, depth in entries.values())
+    print(f'wrote {len(entries)} positions to {path}, {solved} of them proven')
+
+class Computer(Player):
+    """Player that picks its column with a Search on a background thread."""
+
+    def __init__(self, color, side, budget=0.5, book=None):
+        super().__init__(color, side)
+        self.search = Search(budget, book=book)
+        self.thread = None
+        self.move = None
+
+    def poll(self, board):
+        """Start thinking about board if idle; the chosen column once the search is done."""
+        if self.thread is None:
+            self.move = None
+            # search a copy, the pygame thread keeps drawing the real board
+            self.thread = threading.Thread(target=self.think, args=(board.copy(),), daemon=True)
+            self.thread.start()
+            return None
+        if self.thread.is_alive():
+            return None
+        self.thread = None
+        print(f'column {self.move}: {self.search.report()}')
+        return self.move
+
+    def think(self, board):
+        self.move = self.search.bestMove(board, self.side)
+
+    def choose(self, board):
+        return self.search.bestMove(board, self.side)
+
+class RandomPlayer(Player):
+    def __init__(self, color, side, rng=random):
+        super().__init__(color, side)
+        self.rng = rng
+
+    def choose(self, board):
+        return self.rng.choice([col for col in range(Board.COLUMNS) if board.canPlay(col)])
+
+class GreedyPlayer(RandomPlayer):
+    """Wins if it can, blocks if it must, otherwise a random column that gives nothing away."""
+
+    def choose(self, board):
+        cols = [col for col in range(Board.COLUMNS) if board.canPlay(col)]
+        own = board.threats(self.side)
+        opponent = board.threats(1 - self.side)
+        for threats in (own, opponent):
+            for col in cols:
+                if threats & (1 << board.heights[col]):
+                    return col
+        safe = [col for col in cols if not opponent & (1 << (board.heights[col] + 1))]
+        return self.rng.choice(safe or cols)
+
+def benchmark(games=2000):
+    """Moves per second of the bitboard against the old Slot/Coin object model."""
+    rng = random.Random(0)
+    board = Board()
+    sequences = []
+    for _ in range(games):
+        side = 0
+        while not board.isFull():
+            col = rng.choice([c for c in range(Board.COLUMNS) if board.canPlay(c)])
+            board.play(col, side)
+            if board.isWin(side):
+                break
+            side ^= 1
+        sequences.append(list(board.moves))
+        while board.moves:
+            board.undo()
+    total = sum(len(moves) for moves in sequences)
+
+    start = time.perf_counter()
+    for moves in sequences:
+        side = 0
+        for col in moves:
+            board.play(col, side)
+            board.isWin(side)
+            side ^= 1
+        while board.moves:
+            board.undo()
+    bitboard = total / (time.perf_counter() - start)
+
+    # the representation this module used before the bitboard: one Slot per cell
+    slots = [[Slot(Position(row, col), Coin(col, row, Color.WHITE)) for col in range(Board.COLUMNS)]
+             for row in range(Board.ROWS)]
+    colors = (Color.RED, Color.YELLOW)
+
+    def putCoin(col, color):
+        for row in range(Board.ROWS - 1, -1, -1):
+            if slots[row][col].coin.color == Color.WHITE:
+                slots[row][col].coin.color = color
+                return True
+        return False
+
+    def isWin(color):
+        for columns in slots:
+            for slot in columns:
+                for drow, dcol in ((1, 0), (0, 1), (1, 1), (1, -1)):
+                    row, col = slot.position.row, slot.position.col
+                    count = 0
+                    while 0 <= row < Board.ROWS and 0 <= col < Board.COLUMNS and slots[row][col].coin.color == color:
+                        count += 1
+                        if count == 4:
+                            return True
+                        row += drow
+                        col += dcol
+        return False
+
+    start = time.perf_counter()
+    for moves in sequences:
+        side = 0
+        for col in moves:
+            putCoin(col, colors[side])
+            isWin(colors[side])
+            side ^= 1
+        for columns in slots:
+            for slot in columns:
+                slot.coin.color = Color.WHITE
+    objects = total / (time.perf_counter() - start)
+
+    print(f'{total} moves over {games} random games (play + win check, then undo)')
+    print(f'bitboard:     {bitboard:12,.0f} moves/s')
+    print(f'object model: {objects:12,.0f} moves/s')
+    print(f'speedup:      {bitboard / objects:12.1f}x')
+
+def batchBenchmark(games=5000):
+    """Positions per second of batchWinners against isGameOver board by board."""
+    rng = random.Random(0)
+    positions = []
+    expected = []
+    for _ in range(games):
+        board = Board()
+        side = 0
+        while not board.isFull():
+            col = rng.choice([c for c in range(Board.COLUMNS) if board.canPlay(c)])
+            board.play(col, side)
+            positions.append(board.copy())
+            # games stop at the first line, so only the final position has a winner
+            won = board.isWin(side)
+            expected.append(side if won else -1)
+            if won:
+                break
+            side ^= 1
+
+    start = time.perf_counter()
+    looped = [(len(board.moves) - 1) % 2 if isGameOver(board, board.moves[-1]) else -1 for board in positions]
+    loop = len(positions) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    cells = toTensor(positions)
+    convert = len(positions) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    winners = batchWinners(cells)
+    batch = len(positions) / (time.perf_counter() - start)
+
+    assert looped == expected and winners.tolist() == expected, 'batch and per-board winners disagree'
+    print(f'{len(positions)} positions from {games} random games, all winners agree')
+    print(f'isGameOver loop: {loop:14,.0f} positions/s')
+    print(f'toTensor:        {convert:14,.0f} positions/s')
+    print(f'batchWinners:    {batch:14,.0f} positions/s')
+    print(f'speedup:         {batch / loop:14.1f}x (batchWinners on a ready tensor)')
+
+def sparseBenchmark(moves=20000):
+    """Moves per second on SparseBoard for growing board sizes."""
+    for columns, rows, connect in ((Board.COLUMNS, Board.ROWS, Board.CONNECT), (50, 50, 5), (1000, 1000, 5)):
+        rng = random.Random(0)
+        board = SparseBoard(rows, columns, connect)
+        side = 0
+        start = time.perf_counter()
+        for _ in range(moves):
+            col = rng.randrange(columns)
+            while not board.canPlay(col):
+                col = rng.randrange(columns)
+            board.play(col, side)
+            if isGameOver(board, col) or board.isFull():
+                board = SparseBoard(rows, columns, connect)
+            side ^= 1
+        rate = moves / (time.perf_counter() - start)
+        label = f'sparse {columns}x{rows} connect {connect}:'
+        print(f'{label:30}{rate:12,.0f} moves/s')
+
+def playGame(job):
+    """Play one game without a display; returns (seed, moves, winning side or None)."""
+    seed, kinds, budget, book = job
+    rng = random.Random(seed)
+    players = []
+    for side, kind in enumerate(kinds):
+        color = (Color.RED, Color.YELLOW)[side]
+        if kind == 'search':
+            players.append(Computer(color, side, budget, loadBook(book)))
+        elif kind == 'greedy':
+            players.append(GreedyPlayer(color, side, rng))
+        else:
+            players.append(RandomPlayer(color, side, rng))
+
+    board = Board()
+    side = 0
+    while True:
+        col = players[side].choose(board)
+        if not players[side].putCoin(board, col):
+            raise ValueError(f'{kinds[side]} played full column {col} after {board.moves}')
+        won = isGameOver(board, col)
+        # the per-move line check and the bitboard must agree on every position
+        assert won == board.isWin(side), f'win checks disagree after {board.moves}'
+        if won:
+            return seed, board.moves, side
+        if board.isFull():
+            return seed, board.moves, None
+        side ^= 1
+
+def selfPlay(games, kinds, workers, path, seed=0, budget=0.05, book=None):
+    """Play games across a process pool and write one line per game to path.
+
+    A line reads '<seed> <moves> <result>': moves are the column digits in
+    order, result is the winning side (0 moves first) or '-' for a draw.
+    """
+    jobs = [(seed + game, kinds, budget, book) for game in range(games)]
+    results = [0, 0, 0]
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool, open(path, 'w') as records:
+        chunksize = max(1, games // (workers * 16))
+        for gameSeed, moves, winner in pool.imap_unordered(playGame, jobs, chunksize):
+            records.write(f"{gameSeed} {''.join(map(str, moves))} {'-' if winner is None else winner}\n")
+            results[2 if winner is None else winner] += 1
+    elapsed = time.perf_counter() - start
+
+    print(f'{games} games of {kinds[0]} vs {kinds[1]} in {elapsed:.2f}s on {workers} workers')
+    print(f'{games / elapsed:,.1f} games/s, {games / elapsed / workers:,.1f} games/s per core')
+    print(f'{kinds[0]} wins {results[0]}, {kinds[1]} wins {results[1]}, draws {results[2]}')
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Connect four')
+    parser.add_argument('--ai', choices=['red', 'yellow', 'both'], help='let the computer play this colour')
+    parser.add_argument('--think', type=float, default=0.5, help='computer time budget per move in seconds')
+    parser.add_argument('--size', default=f'{Board.COLUMNS}x{Board.ROWS}', help='board size as COLUMNSxROWS')
+    parser.add_argument('--connect', type=int, default=Board.CONNECT, help='coins in a row needed to win')
+    parser.add_argument('--bench', action='store_true', help='benchmark the board representation and exit')
+    parser.add_argument('--selfplay', type=int, metavar='GAMES', help='play GAMES games without a window and exit')
+    parser.add_argument('--players', nargs=2, choices=['random', 'greedy', 'search'], default=['greedy', 'random'],
+                        help='self-play strategies for the first and second player')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='self-play worker processes')
+    parser.add_argument('--records', default='selfplay.txt', help='self-play move records file')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first self-play game')
+    parser.add_argument('--book', help='opening book the computer consults before searching')
+    parser.add_argument('--build-book', type=int, metavar='PLIES',
+                        help='search every opening up to PLIES coins, write it to --book and exit')
+    parser.add_argument('--book-think', type=float, default=10.0,
+                        help='time budget per position in seconds when building a book')
+    args = parser.parse_args()
+
+    try:
+        columns, rows = map(int, args.size.lower().split('x'))
+    except ValueError:
+        parser.error(f'--size must look like {Board.COLUMNS}x{Board.ROWS}, not {args.size}')
+    if columns < 1 or rows < 1:
+        parser.error(f'--size must be at least 1x1, not {args.size}')
+    if args.connect < 2:
+        parser.error(f'--connect must be at least 2, not {args.connect}')
+    classic = (rows, columns, args.connect) == (Board.ROWS, Board.COLUMNS, Board.CONNECT)
+    if not classic and args.ai:
+        parser.error(f'the computer only plays {Board.COLUMNS}x{Board.ROWS} connect {Board.CONNECT}')
+
+    if args.build_book is not None:
+        if not args.book:
+            parser.error('--build-book needs --book PATH')
+        buildBook(args.book, args.build_book, args.workers, args.book_think)
+        sys.exit(0)
+
+    if args.bench:
+        benchmark()
+        sparseBenchmark()
+        if np is not None:
+            batchBenchmark()
+        else:
+            print('numpy is not installed, skipping the batch win detection benchmark')
+        sys.exit(0)
+
+    if args.selfplay:
+        selfPlay(args.selfplay, args.players, args.workers, args.records, args.seed, args.think, args.book)
+        sys.exit(0)
+
     pygame.init()
     gameOver = False
     clock = pygame.time.Clock()
     screen = pygame.display.set_mode((Window.WIDTH, Window.HEIGHT))
 
-    board = Board()
-    cursor = Cursor()
-    players = [Player(Color.RED), Player(Color.YELLOW)]
+    board = Board() if classic else SparseBoard(rows, columns, args.connect)
+    cursor = Cursor(board.columns)
+    players = [
+        Computer(Color.RED, 0, args.think, loadBook(args.book)) if args.ai in ('red', 'both') else Player(Color.RED, 0),
+        Computer(Color.YELLOW, 1, args.think, loadBook(args.book)) if args.ai in ('yellow', 'both') else Player(Color.YELLOW, 1),
+    ]
     myTurn = False
 
+    view = BoardView(screen, board)
+    view.render(board, players)
+    pygame.display.flip()
+
+    winner = None
+
     FONT_SIZE = 180
     text_font = pygame.font.SysFont(None, FONT_SIZE)
-    text_surface = text_font.render(f'{'RED' if myTurn else 'YELLOW'} wins', True, Color.BLACK, Color.WHITE)
-    x = 30
-    y = text_surface.get_height() + 100
 
     while not gameOver:
+        player = players[0 if myTurn else 1]
+        col = None
+        dirty = []
+        scrolled = False
+
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 gameOver = True
@@ -205,20 +1022,46 @@ if __name__ == '__main__':
                     cursor.left()
                 elif event.key == ord('d'):
                     cursor.right()
-                elif event.key == pygame.K_SPACE:
-                    if players[0 if myTurn else 1].putCoin(cursor.col):
-                        myTurn = not myTurn
+                elif event.key == ord('w'):
+                    scrolled = view.scroll(board, -1) or scrolled
+                elif event.key == ord('s'):
+                    scrolled = view.scroll(board, 1) or scrolled
+                elif event.key == pygame.K_SPACE and not isinstance(player, Computer):
+                    col = cursor.col
+
+        scrolled = view.follow(cursor.col) or scrolled
 
-        screen.fill(Color.WHITE)
+        if isinstance(player, Computer) and not gameOver:
+            col = player.poll(board)
 
-        board.draw()
-        cursor.draw()
+        if col is not None and player.putCoin(board, col):
+            if view.follow(col, board.top(col)):
+                scrolled = True
+            else:
+                dirty.append(view.drop(board, col, player.color))
+            # only the coin just dropped can complete a line
+            if isGameOver(board, col):
+                winner = player
+                gameOver = True
+            elif board.isFull():
+                gameOver = True
+            else:
+                myTurn = not myTurn
 
-        gameOver = isGameOver()
+        if scrolled:
+            dirty.append(view.render(board, players))
+            cursor.drawn = None  # painted over by the render
+        dirty += cursor.draw(screen, view.background, players[0 if myTurn else 1].color, view.left)
 
-        pygame.display.flip()
+        # idle frames leave dirty empty and touch no pixels
+        pygame.display.update(dirty)
         clock.tick(Window.FPS)
 
-    screen.blit(text_surface, (x, y))
-    pygame.display.flip()
-    time.sleep(3)
\ No newline at end of file
+    if winner is not None or board.isFull():
+        text = 'Draw' if winner is None else f"{'RED' if winner is players[0] else 'YELLOW'} wins"
+        text_surface = text_font.render(text, True, Color.BLACK, Color.WHITE)
+        x = 30
+        y = text_surface.get_height() + 100
+        screen.blit(text_surface, (x, y))
+        pygame.display.flip()
+        time.sleep(3)
@@ -1,44 +1,272 @@
 import os
+import sys
+import argparse
 import curses
+import math
+import mmap
+import random
+import struct
+import tempfile
 import time
 
+from sprites import SpriteLayer, getSprite, measure
+
+TICK_RATE = 60          # Physics ticks per second
+MAX_FRAME_TIME = 0.25   # s; longer stalls are not caught up on
+GRAVITY = 80            # cells/s²
+JUMP_SPEED = 24         # cells/s, about 3.5 cells high
+WALK_SPEED = 16         # cells/s
+HOLD_TIME = 0.1         # s a key counts as held after its last repeat
+REPEAT_DELAY = 0.6      # s it counts as held after its first press, before repeats start
+MAX_FALL_SPEED = 40     # cells/s, under a cell a tick so no tile is fallen through
+PLAYER_WIDTH = 2        # cells the player's sprite covers
+
+CHUNK_WIDTH = 32        # Level columns per chunk
+CHUNK_CACHE = 16        # Decoded chunks kept, at least
+PREFETCH = 1            # Chunks decoded ahead of the camera on either side
+LEVEL_HEIGHT = 20
+LEVEL_MAGIC = b'HNRL'
+LEVEL_VERSION = 1
+LEVEL_HEADER = struct.Struct('<4sHHHI')  # magic, version, chunk width, height, chunks
+SOLID = '#='
+TILE_GLYPHS = str.maketrans({'#': '█', '=': '▀'})
+
+# Keys gathered from every event since the last tick. Terminals send presses and
+# repeats but never releases, and only start repeating a held key after a delay
+# of their own. So a key counts as held for REPEAT_DELAY after it is pressed,
+# and once its repeats are coming, until HOLD_TIME passes without one.
+class Input:
+    def __init__(self):
+        self.pressed = set()    # keys with an event since the last tick
+        self.last_seen = {}     # key -> time of its latest event
+        self.repeating = set()  # keys whose repeats are coming in
+
+    def press(self, key, now):
+        if self.held(key, now):
+            self.repeating.add(key)
+        else:
+            self.repeating.discard(key)
+        self.pressed.add(key)
+        self.last_seen[key] = now
+
+    def held(self, key, now):
+        window = HOLD_TIME if key in self.repeating else REPEAT_DELAY
+        return key in self.pressed or now - self.last_seen.get(key, -window) < window
+
+    def next_tick(self):
+        self.pressed.clear()
+
+# A level on disk: a header, then fixed-width chunks of tile rows at one byte a
+# tile. The file is mapped rather than read and a chunk is only decoded when
+# something asks for it, so memory holds the chunks around the camera and no more.
+class Level:
+    def __init__(self, path, cache_size=CHUNK_CACHE):
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < LEVEL_HEADER.size:
+            raise ValueError(f'{path}: not a level')
+        magic, version, self.chunk_width, self.height, self.chunks = LEVEL_HEADER.unpack_from(self.data)
+        if magic != LEVEL_MAGIC or version != LEVEL_VERSION:
+            raise ValueError(f'{path}: not a level')
+        if len(self.data) != LEVEL_HEADER.size + self.chunks * self.chunk_width * self.height:
+            raise ValueError(f'{path}: truncated level')
+        self.width = self.chunks * self.chunk_width
+        self.cache_size = cache_size
+        self.cache = {}         # Chunk index -> rows, least recently used first
+
+    def chunk(self, index):
+        rows = self.cache.pop(index, None)
+        if rows is None:
+            size = self.chunk_width * self.height
+            offset = LEVEL_HEADER.size + index * size
+            tiles = self.data[offset:offset + size].decode('ascii')
+            rows = [tiles[y:y + self.chunk_width] for y in range(0, size, self.chunk_width)]
+            if len(self.cache) >= self.cache_size:
+                del self.cache[next(iter(self.cache))]
+        self.cache[index] = rows
+        return rows
+
+    def prefetch(self, x, width):
+        # Touching the chunks around a window keeps them decoded and leaves the
+        # ones furthest behind to be evicted first
+        first = max(x // self.chunk_width - PREFETCH, 0)
+        last = min((x + width) // self.chunk_width + PREFETCH, self.chunks - 1)
+        for index in range(first, last + 1):
+            self.chunk(index)
+
+    def tile(self, x, y):
+        # Walls past either end, open air above and below
+        if x < 0 or x >= self.width:
+            return '#'
+        if y < 0 or y >= self.height:
+            return ' '
+        return self.chunk(x // self.chunk_width)[y][x % self.chunk_width]
+
+    def row(self, y, x, width):
+        # Tiles x to x + width of row y, blank where there is no level
+        if y < 0 or y >= self.height:
+            return ' ' * width
+        end = min(x + width, self.width)
+        pieces = []
+        while x < end:
+            index, column = divmod(x, self.chunk_width)
+            take = min(self.chunk_width - column, end - x)
+            pieces.append(self.chunk(index)[y][column:column + take])
+            x += take
+        return ''.join(pieces).ljust(width)
+
+def make_level(path, chunks, height=LEVEL_HEIGHT, rng=random):
+    # Rolling ground with gaps to jump and platforms overhead, written a chunk at
+    # a time so a level can be bigger than memory. The first chunk is flat, and
+    # past every gap, step or platform is a run of ground to land or take off from.
+    ground = height - 4
+    gap = calm = platform = platform_y = 0
+    with open(path, 'wb') as file:
+        file.write(LEVEL_HEADER.pack(LEVEL_MAGIC, LEVEL_VERSION, CHUNK_WIDTH, height, chunks))
+        for index in range(chunks):
+            columns = []
+            for _ in range(CHUNK_WIDTH):
+                column = bytearray(b' ' * height)
+                if index and not gap and not calm and not platform:
+                    if rng.random() < 0.04:
+                        gap = rng.randint(2, 5)
+                        calm = gap + 12
+                    elif rng.random() < 0.06:
+                        ground = min(max(ground + rng.choice((-2, -1, 1, 2)), height // 2), height - 2)
+                        calm = 12
+                    elif rng.random() < 0.04:
+                        platform = rng.randint(4, 10)
+                        platform_y = ground - 3
+                        calm = platform + 8
+                calm = max(calm - 1, 0)
+                if gap:
+                    gap -= 1
+                else:
+                    column[ground:] = b'#' * (height - ground)
+                if platform:
+                    platform -= 1
+                    column[platform_y] = ord('=')
+                columns.append(column)
+            file.write(b''.join(bytes(column[y] for column in columns) for y in range(height)))
+
+# The window of the level on screen, kept on the player
+class Camera:
+    def __init__(self, width, height):
+        self.x = 0
+        self.y = 0
+        self.width = width
+        self.height = height
+
+    def follow(self, player, level):
+        self.x = min(max(round(player.x) - self.width // 3, 0), max(level.width - self.width, 0))
+        # A level shorter than the screen sits at the bottom
+        self.y = min(max(round(player.y) - self.height // 2, 0), level.height - self.height)
+
 class Game:
-    def __init__(self, stdscr, trm_col, trm_row):
+    def __init__(self, stdscr, trm_col, trm_row, level):
         self.stdscr = stdscr
         self.trm_col = trm_col
         self.trm_row = trm_row
-        self.player = Player(3, self.trm_row - 3)
+        self.level = level
+        self.sprites = SpriteLayer(stdscr)
+        self.camera = Camera(trm_col, trm_row - 1)   # Row 0 is the help line
+        # Enough chunks for the screen and the prefetch on both sides
+        level.cache_size = max(level.cache_size, math.ceil(trm_col / level.chunk_width) + 2 * PREFETCH + 2)
+        self.player = Player(3, 0)
+        self.respawn()
 
-    def drawFloor(self):
-        floorTiles = self.trm_col * '_'
-        self.stdscr.addstr(floorTiles)
+    def respawn(self):
+        player = self.player
+        player.x = 3
+        player.y = 0
+        player.vx = player.vy = 0.0
+        while player.y < self.level.height - 1 and not self.collides(player.x, player.y + 1):
+            player.y += 1
+        player.land()
+
+    def collides(self, x, y):
+        # Any solid tile under the player's box at x, y
+        return any(self.level.tile(column, row) in SOLID
+                   for column in range(math.floor(x), math.ceil(x + PLAYER_WIDTH))
+                   for row in range(math.floor(y), math.ceil(y + 1)))
+
+    def drawLevel(self):
+        camera = self.camera
+        camera.follow(self.player, self.level)
+        self.level.prefetch(camera.x, camera.width)
+        for row in range(camera.height):
+            tiles = self.level.row(camera.y + row, camera.x, camera.width).translate(TILE_GLYPHS)
+            if row == camera.height - 1:
+                tiles = tiles[:-1]  # Writing the bottom right cell fails
+            self.stdscr.addstr(row + 1, 0, tiles)
 
     def drawPlayer(self):
-        self.stdscr.addstr(self.player.y, self.player.x, self.player.get_frame())
+        # After the level, which would otherwise draw over the blanks it leaves
+        y = round(self.player.y) - self.camera.y
+        x = round(self.player.x) - self.camera.x
+        if 0 <= y < self.camera.height:
+            self.sprites.place(y + 1, x, getSprite(self.player.get_frame()))
 
-    def walkPlayer(self, dx):
-        if dx > 0 and self.player.x < self.trm_col or dx < 0 and self.player.x > 0:
-            self.player.walk(dx)
+    def walkPlayer(self, direction):
+        # In the air the player keeps the speed they jumped with
+        if direction or self.player.on_ground:
+            self.player.walk(direction * WALK_SPEED)
 
-    def jumpPlayer(self, dy):
-        if dy > 0 and self.player.y < 0:
-            self.player.jump(dy)
+    def jumpPlayer(self):
+        if self.player.on_ground:
+            self.player.jump(JUMP_SPEED)
 
-    def idlePlayer(self):
-        if self.player.y == self.trm_row - 3:
-            # On floor
-            self.player.walk(0)
-        else:
-            self.player.jump(-1)
+    def update(self, keys, now):
+        left = keys.held(ord('a'), now)
+        right = keys.held(ord('d'), now)
+        self.walkPlayer(right - left)
+        if ord('w') in keys.pressed:
+            self.jumpPlayer()
+
+        self.movePlayer(1 / TICK_RATE)
+        if self.player.y >= self.level.height:
+            self.respawn()
+
+    def movePlayer(self, dt):
+        player = self.player
+        walking = player.on_ground
+        cell = round(player.x)
+        player.vy = min(player.vy + GRAVITY * dt, MAX_FALL_SPEED)
+
+        # One axis at a time, stopping flush against whatever tile was hit
+        x = player.x + player.vx * dt
+        if self.collides(x, player.y):
+            x = math.ceil(x + PLAYER_WIDTH) - 1 - PLAYER_WIDTH if player.vx > 0 else math.floor(x) + 1
+            player.vx = 0
+        player.x = x
+
+        y = player.y + player.vy * dt
+        player.on_ground = False    # Until the ground says otherwise
+        if self.collides(x, y):
+            if player.vy > 0:
+                y = math.ceil(y + 1) - 2
+                player.land()
+            else:
+                y = math.floor(y) + 1
+                player.vy = 0
+        player.y = y
+
+        # One walking frame per cell covered, mid-stride while in the air
+        if walking and round(player.x) != cell:
+            player.next_frame()
 
 class Player:
+    frames_idle = ['🧍🏻‍♂️']
+    frames_walk_r = ['🚶🏻‍♂️‍➡️', '🏃🏻‍♂️‍➡️']
+    frames_walk_l = ['🚶🏻‍♂️', '🏃🏻‍♂️']
+
     def __init__(self, x, y):
-        self.x = x
+        self.x = x              # Cells, fractional between ticks
         self.y = y
+        self.vx = 0.0           # cells/s
+        self.vy = 0.0
+        self.on_ground = True
         self.frames_index = 0
-        self.frames_idle = ['🧍🏻‍♂️']
-        self.frames_walk_r = ['🚶🏻‍♂️‍➡️', '🏃🏻‍♂️‍➡️']
-        self.frames_walk_l = ['🚶🏻‍♂️', '🏃🏻‍♂️']
         self.frames_current = self.frames_idle
 
     def get_frame(self):
@@ -50,58 +278,90 @@ class Player:
         else:
             self.frames_index += 1
 
-    def walk(self, dx):
-        self.x += dx
+    def walk(self, vx):
+        self.vx = vx
 
-        if dx > 0:
+        if vx > 0:
             self.frames_current = self.frames_walk_r
-        elif dx < 0:
+        elif vx < 0:
             self.frames_current = self.frames_walk_l
-        else:
+        elif self.on_ground:
             self.frames_current = self.frames_idle
+            self.frames_index = 0
 
-        self.next_frame()
-
-    def jump(self, dy):
-        self.y -= dy
+    def jump(self, vy):
+        self.vy = -vy
+        self.on_ground = False
 
         if self.frames_current == self.frames_idle:
             self.frames_current = self.frames_walk_r
         self.frames_index = 1
 
-def main(stdscr):
+    def land(self):
+        self.vy = 0.0
+        self.on_ground = True
+
+def main(stdscr, level):
 
     trm_col, trm_row = os.get_terminal_size()
 
     curses.curs_set(0)          # Hide cursor
     stdscr.nodelay(True)        # Non-blocking input
-    stdscr.timeout(10)          # Refresh every 50 ms (~20 FPS)
+    measure(stdscr, Player.frames_idle + Player.frames_walk_r + Player.frames_walk_l)
 
-    game = Game(stdscr, trm_col, trm_row)
+    game = Game(stdscr, trm_col, trm_row, level)
+    keys = Input()
+    accumulator = 0.0           # s of simulation owed
+    previous = time.perf_counter()
 
     while True:
+        now = time.perf_counter()
+
+        # Every key since the last frame, so none wait behind the others
         key = stdscr.getch()
+        while key != -1:
+            if key == ord('q'):
+                return
+            keys.press(key, now)
+            key = stdscr.getch()
 
-        if key == ord('q'):
-            break
-        elif key == ord('a'):
-            game.walkPlayer(-1)
-        elif key == ord('d'):
-            game.walkPlayer(1)
-        elif key == ord('w'):
-            game.player.jump(1)
-        else: # idle
-            game.idlePlayer()
+        accumulator += min(now - previous, MAX_FRAME_TIME)
+        previous = now
 
+        ticks = 0
+        while accumulator >= 1 / TICK_RATE:
+            accumulator -= 1 / TICK_RATE
+            game.update(keys, now)
+            keys.next_tick()
+            ticks += 1
 
-        stdscr.clear()
+        if not ticks:
+            time.sleep(1 / TICK_RATE - accumulator)
+            continue
 
-        game.drawFloor()
+        # Everything is drawn over every frame, so curses sends only what changed
+        game.drawLevel()
         game.drawPlayer()
-        # stdscr.addstr(y, x, "@")   # Player
         stdscr.addstr(0, 0, "Press Q to quit")
-        stdscr.refresh()
+        game.sprites.present()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run and jump through a side-scrolling level.')
+    parser.add_argument('level', nargs='?', help='level file to play, a random one when left out')
+    parser.add_argument('--make', type=int, metavar='CHUNKS', help=f'write a random level of this many {CHUNK_WIDTH}-column chunks to LEVEL and quit')
+    parser.add_argument('--seed', type=int, help='seed for a random level')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
 
-        time.sleep(0.02)
+    if args.make:
+        if not args.level:
+            parser.error('--make needs a LEVEL file to write')
+        make_level(args.level, args.make, rng=rng)
+        sys.exit(0)
 
-curses.wrapper(main)
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.level
+        if not path:
+            path = os.path.join(directory, 'level')
+            make_level(path, 64, rng=rng)
+        curses.wrapper(main, Level(path))
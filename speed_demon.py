@@ -1,17 +1,192 @@
 import os
 import sys
+import argparse
 import curses
+import multiprocessing
+import statistics
 import time
 import random
+import struct
+from array import array
+from collections import deque
+from itertools import islice
 from dataclasses import dataclass
 
-def getRandomVehicle():
-    VEHICLE_IMGS = ['🚌','🚐','🚑','🚕','🚜','🚛','🚚','🚙','🚗']
-    return VEHICLE_IMGS[random.randint(0, len(VEHICLE_IMGS) - 1)]
-
-def getRandomTree():
-    TREE_IMGS = ['🌲', '🌳', '🌴', '🎄']
-    return TREE_IMGS[random.randint(0, len(TREE_IMGS) - 1)]
+from sprites import layout, measure
+
+# Difficulty is the simulation rate: it starts at START_TPS ticks per second and
+# gains TPS_RAMP with every tick until it reaches MAX_TPS. The simulation runs
+# at that rate however long the terminal takes to draw; frames that cannot keep
+# up are dropped, never the ticks.
+START_TPS = 30
+MAX_TPS = 100
+TPS_RAMP = 0.35
+MAX_FRAME_TIME = 0.25  # s of simulation caught up after a stall, at most
+STATS_SMOOTHING = 0.1  # weight of the newest frame in the on-screen averages
+
+VEHICLE_IMGS = ['🚌','🚐','🚑','🚕','🚜','🚛','🚚','🚙','🚗']
+TREE_IMGS = ['🌲', '🌳', '🌴', '🎄']
+LANE_LINE_IMG = '___'
+SPAWN_RATE = 0.1  # chance of a new vehicle each tick
+
+AUTOPILOT_BUDGET = 0.001  # s the autopilot may think per tick
+AUTOPILOT_HORIZON = 24  # ticks the autopilot looks ahead, at most
+AUTOPILOT_MIN_LOOKAHEAD = 2  # ticks it always looks ahead, budget or not
+
+VEHICLE_WIDTH = 2  # cells
+VEHICLE_SPEEDS = {'🚑': 2}  # cells per tick, 1 for the rest
+
+# entities store a sprite id, an index into SPRITES
+SPRITES = [LANE_LINE_IMG, *TREE_IMGS, *VEHICLE_IMGS]
+SPRITE_IDS = {img: sprite for sprite, img in enumerate(SPRITES)}
+
+UP = -2
+DOWN = 2
+SIDEWALK_OFFSET = 4
+MIN_WIDTH = 20  # room for a vehicle to spawn behind the bike
+MIN_HEIGHT = 2 * SIDEWALK_OFFSET  # one lane between the sidewalks
+
+# replay file: header (magic, version, seed, width, height, ticks played), then
+# (tick, key) for every key press, applied at the start of that tick
+REPLAY_MAGIC = b'SPDR'
+REPLAY_VERSION = 1
+REPLAY_HEADER = struct.Struct('<4sBQHHI')
+REPLAY_EVENT = struct.Struct('<Ic')
+
+def getRandomVehicle(rng=random):
+    return VEHICLE_IMGS[rng.randint(0, len(VEHICLE_IMGS) - 1)]
+
+def getRandomTree(rng=random):
+    return TREE_IMGS[rng.randint(0, len(TREE_IMGS) - 1)]
+
+class Screen:
+    # Double-buffered model of the terminal. A frame is composed in memory with
+    # put(), then present() compares it with the frame on screen and writes only
+    # the runs of cells that changed, so a tick sends a few hundred bytes instead
+    # of the whole terminal. A cell holds a glyph, or None when it is covered by
+    # the wide glyph to its left.
+    def __init__(self, stdscr):
+        self.stdscr = stdscr
+        self.frames = 0
+        self.lastBytes = 0
+        self.totalBytes = 0
+        self.maxBytes = 0
+        self.resize()
+
+    def resize(self):
+        self.height, self.width = self.stdscr.getmaxyx()
+        self.stdscr.erase()
+        self.front = [[' '] * self.width for _ in range(self.height)]
+        self.back = [[' '] * self.width for _ in range(self.height)]
+
+    def put(self, y, x, text):
+        if not 0 <= y < self.height:
+            return
+        row = self.back[y]
+        if x >= 0 and text.isascii():
+            # one cell per character, which is most of what gets drawn
+            end = x + len(text)
+            if end > self.width:
+                end = self.width
+                if x >= end:
+                    return
+                text = text[:end - x]
+            if row[x] is None:
+                row[x - 1] = ' '
+            if end < self.width and row[end] is None:
+                row[end] = ' '
+            row[x:end] = text
+            return
+        for glyph, cells in layout(text):
+            if x + cells > self.width:
+                break
+            if x >= 0:
+                # whatever this glyph lands on half of is wiped rather than left torn
+                if row[x] is None:
+                    row[x - 1] = ' '
+                if x + cells < self.width and row[x + cells] is None:
+                    row[x + cells] = ' '
+                row[x] = glyph
+                if cells == 2:
+                    row[x + 1] = None
+            x += cells
+
+    def putCells(self, y, x, cells):
+        # a row of cells as the grid holds them, None following each wide glyph,
+        # copied in one go
+        if not 0 <= y < self.height:
+            return
+        end = min(x + len(cells), self.width)
+        if x >= end:
+            return
+        row = self.back[y]
+        if row[x] is None:
+            row[x - 1] = ' '
+        if end < self.width and row[end] is None:
+            row[end] = ' '
+        row[x:end] = cells[:end - x]
+        if end - x < len(cells) and cells[end - x] is None:
+            row[end - 1] = ' '
+
+    def present(self):
+        # Only rows that changed are touched, and of those only the span from the
+        # first to the last changed cell. curses compares that span with what the
+        # terminal shows when doupdate() runs and sends just the difference.
+        written = 0
+        for y in range(self.height):
+            back = self.back[y]
+            front = self.front[y]
+            if back != front:
+                first = 0
+                while back[first] == front[first]:
+                    first += 1
+                if back[first] is None:
+                    first -= 1
+                end = self.width
+                while back[end - 1] == front[end - 1]:
+                    end -= 1
+                written += self.__write(y, first, back[first:end])
+            self.front[y] = back
+            self.back[y] = [' '] * self.width
+        self.stdscr.noutrefresh()
+        curses.doupdate()
+
+        self.frames += 1
+        self.lastBytes = written
+        self.totalBytes += written
+        self.maxBytes = max(self.maxBytes, written)
+        return written
+
+    def __write(self, y, x, cells):
+        # one addstr, except that an emoji made wide by VS16 ends it: curses counts
+        # it as one cell and the terminal as two, so what follows is addressed afresh
+        text = ''.join(filter(None, cells))
+        if '\ufe0f' not in text:
+            return self.__addstr(y, x, text)
+
+        written = 0
+        start = x
+        run = []
+        for glyph in cells:
+            x += 1
+            if glyph is None:
+                continue
+            run.append(glyph)
+            if '\ufe0f' in glyph:
+                written += self.__addstr(y, start, ''.join(run))
+                start = x + 1
+                run = []
+        if run:
+            written += self.__addstr(y, start, ''.join(run))
+        return written
+
+    def __addstr(self, y, x, text):
+        # returns about how many bytes reach the terminal for it
+        try:
+            self.stdscr.addstr(y, x, text)
+        except curses.error:
+            pass  # writing the bottom right cell moves the cursor off screen
+        return len(text.encode()) + len(f'\x1b[{y + 1};{x + 1}H')
 
 @dataclass
 class Object:
@@ -22,160 +197,557 @@ class Object:
 class Player(Object):
     img: str = '🏍️'
 
-@dataclass
-class Vehicle(Object):
-    img: str
-    
-@dataclass
-class Tree(Object):
-    img: str
+class Scenery:
+    # Things that scroll with the road, stored as columns of x, y and sprite id
+    # rather than an object each. They all move together, so the columns hold
+    # where each one started and scrolling bumps a single shared offset.
+    # Since the scenery repeats every width columns, each row is laid out once as
+    # a strip of cells two widths long, and any scroll position is a slice of it.
+    def __init__(self, width):
+        self.width = width
+        self.xs = array('H')
+        self.ys = array('H')
+        self.sprites = array('B')
+        self.offset = 0
+        self.strips = None  # y -> cells, built on first draw
+
+    def __len__(self):
+        return len(self.xs)
+
+    def add(self, x, y, img):
+        self.xs.append(x)
+        self.ys.append(y)
+        self.sprites.append(SPRITE_IDS[img])
+        self.strips = None
+
+    def scroll(self):
+        self.offset = self.offset + 1 if self.offset < self.width - 1 else 0
+
+    def buildStrips(self):
+        # cell i of a strip shows what is at column i % width of the row when not
+        # scrolled; one cell more than two widths so a wide glyph at the end fits
+        width = self.width
+        self.strips = {}
+        for x, y, sprite in zip(self.xs, self.ys, self.sprites):
+            strip = self.strips.setdefault(y, [' '] * (2 * width + 1))
+            for start in (x - width, x, x + width):
+                for glyph, cells in layout(SPRITES[sprite]):
+                    if 0 <= start and start + cells <= len(strip):
+                        strip[start] = glyph
+                        if cells == 2:
+                            strip[start + 1] = None
+                    start += cells
+
+    def draw(self, screen):
+        # one slice per row: column c shows what started at column c - offset
+        if self.strips is None:
+            self.buildStrips()
+        width = self.width
+        start = width - self.offset
+        for y, strip in self.strips.items():
+            cells = strip[start:start + width + 1]
+            if cells[0] is None:
+                cells[0] = ' '
+            if len(cells) > width:
+                # a wide glyph cut by the edge of the road is left out, as put() would
+                if cells[width] is None:
+                    cells[width - 1] = ' '
+                del cells[width:]
+            screen.putCells(y, 0, cells)
+
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in (self.xs, self.ys, self.sprites))
+
+class Lane:
+    # The vehicles in one lane as parallel columns, furthest along first: vehicles
+    # leaving the road come off the head and new ones join at the tail.
+    def __init__(self, y):
+        self.y = y
+        self.xs = deque()
+        self.sprites = deque()
+        self.speeds = deque()
+        self.moved = deque()  # cells covered last tick
+        self.spawned = 0
+
+    def __len__(self):
+        return len(self.xs)
+
+    def spawn(self, x, img):
+        # the newest vehicle is the last one in, so that is the one to keep clear of
+        if self.xs and self.xs[-1] < x + VEHICLE_WIDTH:
+            return False
+        self.xs.append(x)
+        self.sprites.append(SPRITE_IDS[img])
+        self.speeds.append(VEHICLE_SPEEDS.get(img, 1))
+        self.moved.append(0)
+        self.spawned += 1
+        return True
+
+    def advance(self, width):
+        xs, speeds, moved = self.xs, self.speeds, self.moved
+        while xs and xs[0] >= width - 1:
+            xs.popleft()
+            self.sprites.popleft()
+            speeds.popleft()
+            moved.popleft()
+        # a faster vehicle queues up behind a slower one, keeping the lane in order
+        ahead = width + VEHICLE_WIDTH
+        for i in range(len(xs)):
+            x = min(xs[i] + speeds[i], ahead - VEHICLE_WIDTH)
+            moved[i] = x - xs[i]
+            xs[i] = x
+            ahead = x
+
+    def copy(self):
+        lane = Lane(self.y)
+        lane.xs = self.xs.copy()
+        lane.sprites = self.sprites.copy()
+        lane.speeds = self.speeds.copy()
+        lane.moved = self.moved.copy()
+        return lane
+
+    def hits(self, x):
+        # only the vehicles that have not passed x yet matter, and the first of
+        # those is the one that can hit
+        for vehicleX, moved in zip(self.xs, self.moved):
+            if vehicleX < x:
+                return False
+            if vehicleX - moved < x:
+                return True
+        return False
+
+    def draw(self, screen):
+        for x, sprite in zip(self.xs, self.sprites):
+            screen.put(self.y, x, SPRITES[sprite])
+
+def initTrees(width, height, rng=random):
+    TREE_OFFSET = 5
+    yTop = TREE_OFFSET - 3
+    yBot = height - TREE_OFFSET + 3
+    trees = Scenery(width)
+
+    for i in range(round(width / TREE_OFFSET)):
+        x = TREE_OFFSET * i
+        trees.add(x, yTop, getRandomTree(rng))
+        trees.add(x, yBot, getRandomTree(rng))
+    return trees
+
+def initLaneLines(width, height):
+    laneLines = Scenery(width)
+    LANE_LINE_OFFSET = 7
+    for y in range(3, height - 3, 2):
+        for x in range(round(width / LANE_LINE_OFFSET)):
+            laneLines.add(x * LANE_LINE_OFFSET, y, LANE_LINE_IMG)
+    return laneLines
+
+def benchmark(widths=(80, 160, 320, 640, 1280, 2560), height=51, ticks=2000):
+    # the simulation step alone at growing terminal widths, no curses involved;
+    # the height is odd so the bottom lane sits above the sidewalk, not on it
+    print(f'{"width":>6} {"entities":>9} {"bytes":>8} {"ticks/s":>10}')
+    for width in widths:
+        rng = random.Random(width)
+        trees = initTrees(width, height, rng)
+        laneLines = initLaneLines(width, height)
+        lanes = range(SIDEWALK_OFFSET, height - SIDEWALK_OFFSET + 1, 2)
+        vehicles = {lane: Lane(lane) for lane in lanes}
+        playerX, playerY = width - 14, lanes[-1]
+
+        started = time.perf_counter()
+        for _ in range(ticks):
+            vehicles[playerY].hits(playerX)
+            if rng.random() < 0.1:
+                vehicles[rng.randrange(lanes.start, lanes.stop, lanes.step)].spawn(2, getRandomVehicle(rng))
+            trees.scroll()
+            laneLines.scroll()
+            for lane in vehicles.values():
+                lane.advance(width)
+        elapsed = time.perf_counter() - started
+
+        entities = len(trees) + len(laneLines) + sum(len(lane) for lane in vehicles.values())
+        print(f'{width:>6} {entities:>9,} {trees.nbytes() + laneLines.nbytes():>8,} {ticks / elapsed:>10,.0f}')
+
+class Engine:
+    # The game without a terminal. Everything random comes from one generator
+    # seeded up front and the only input is the keys handed to each tick, so a
+    # seed and a list of key presses always play out the same way, drawn or not.
+    def __init__(self, width, height, seed, spawnRate=SPAWN_RATE):
+        self.width = width
+        self.height = height
+        self.seed = seed
+        self.spawnRate = spawnRate
+        self.rng = random.Random(seed)
+        self.gameOver = False
+        self.distance = 0
+        self.ticks = 0
+
+        # lanes are every other row between the sidewalks; the bike only ever rides
+        # in one, starting in the middle
+        self.lanes = range(SIDEWALK_OFFSET, height - SIDEWALK_OFFSET + 1, 2)
+        self.player = Player(width - SIDEWALK_OFFSET - 10, self.lanes[len(self.lanes) // 2])
+        self.vehicles = {lane: Lane(lane) for lane in self.lanes}
+        self.trees = initTrees(width, height, self.rng)
+        self.laneLines = initLaneLines(width, height)
+
+    def ticksPerSecond(self):
+        return min(START_TPS + TPS_RAMP * self.distance, MAX_TPS)
+
+    def tick(self, keys=''):
+        if self.gameOver:
+            return
+        for key in keys:
+            if key == 'w':
+                self.switchLane(UP)
+            elif key == 's':
+                self.switchLane(DOWN)
+
+        self.checkCollision()
+        if not self.gameOver:
+            self.updateVehicles(self.spawnRate)
+            self.passTime()
+        self.ticks += 1
+
+    def switchLane(self, direction):
+        player = self.player
+        if player.y + direction in self.vehicles:
+            player.y += direction
+
+    def checkCollision(self):
+        # only the player's lane matters
+        if self.vehicles[self.player.y].hits(self.player.x):
+            self.player.img = '💥'
+            self.gameOver = True
 
+    def updateVehicles(self, randomizer):
+        if self.rng.random() < randomizer:
+            x = 2
+            lane = self.rng.randrange(self.lanes.start, self.lanes.stop, self.lanes.step)
+            self.vehicles[lane].spawn(x, getRandomVehicle(self.rng))
+
+    def passTime(self):
+        self.distance += 1
+
+        self.trees.scroll()
+        self.laneLines.scroll()
+
+        for lane in self.vehicles.values():
+            lane.advance(self.width)
+
+    def draw(self, screen):
+        # the first row of lane lines runs along the top sidewalk, and whole rows of
+        # scenery are copied in, so the sidewalks go on top
+        self.trees.draw(screen)
+        self.laneLines.draw(screen)
+        screen.put(SIDEWALK_OFFSET - 1, 0, '_' * self.width)
+        screen.put(self.height - SIDEWALK_OFFSET + 1, 0, '_' * self.width)
+        for lane in self.vehicles.values():
+            lane.draw(screen)
+        screen.put(self.player.y, self.player.x, self.player.img)
+
+# Whether the bike would be hit in a lane on each coming tick, worked out on a
+# copy of the lane played forward. It stays right from tick to tick, only
+# shifting by one, until a vehicle spawns in the lane.
 @dataclass
-class LaneLine(Object):
-    img: str = '___'
+class Forecast:
+    ghost: Lane
+    hits: deque
+    spawned: int
+
+class Autopilot:
+    # Picks the key for every tick by playing the traffic forward. Each lane keeps
+    # its order and each vehicle its speed, so where everything on the road will
+    # be is known; only vehicles not spawned yet are missed, and those start far
+    # from the bike. Forecasts are topped up towards the horizon, shortest first,
+    # while the time budget lasts but never to less than AUTOPILOT_MIN_LOOKAHEAD
+    # ticks, then the lane to head for is the one that
+    # survives longest, moving one lane per tick and staying put on a tie.
+    def __init__(self, budget=AUTOPILOT_BUDGET, horizon=AUTOPILOT_HORIZON):
+        self.budget = budget
+        self.horizon = horizon
+        self.forecasts = {}  # lane y -> Forecast
+        self.engine = None
+        self.tick = None
+        self.decisions = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+        self.cutShort = 0  # decisions that ran out of time before the horizon
+
+    def decide(self, engine):
+        started = time.perf_counter()
+        deadline = started + self.budget
+        player = engine.player
+        if engine is not self.engine or engine.ticks != self.tick + 1:
+            self.forecasts = {}
+        self.engine = engine
+        self.tick = engine.ticks
+
+        laneYs = sorted(engine.vehicles)
+        forecasts = []
+        for y in laneYs:
+            lane = engine.vehicles[y]
+            forecast = self.forecasts.get(y)
+            if forecast and forecast.hits and forecast.spawned == lane.spawned:
+                forecast.hits.popleft()
+            else:
+                forecast = self.forecasts[y] = Forecast(lane.copy(), deque(), lane.spawned)
+            forecasts.append(forecast)
+
+        steps = min(len(forecast.hits) for forecast in forecasts)
+        # the next couple of ticks whatever the time, so a late start never
+        # means riding on blind
+        while steps < self.horizon and (steps < AUTOPILOT_MIN_LOOKAHEAD or time.perf_counter() < deadline):
+            for forecast in forecasts:
+                if len(forecast.hits) == steps:
+                    forecast.hits.append(forecast.ghost.hits(player.x))
+                    forecast.ghost.advance(engine.width)
+            steps += 1
+        self.cutShort += steps < self.horizon
+
+        current = laneYs.index(player.y)
+        target = current
+        if True in islice(forecasts[current].hits, steps):
+            # ticks survivable from each lane, worked back from the last tick looked at
+            hits = [forecast.hits for forecast in forecasts]
+            reach = [0] * len(laneYs)
+            for step in range(steps - 1, -1, -1):
+                reach = [0 if hits[lane][step] else 1 + max(reach[max(lane - 1, 0):lane + 2]) for lane in range(len(laneYs))]
+            choices = [lane for lane in (current, current - 1, current + 1) if 0 <= lane < len(laneYs)]
+            target = max(choices, key=lambda lane: reach[lane])
+
+        elapsed = time.perf_counter() - started
+        self.decisions += 1
+        self.totalTime += elapsed
+        self.maxTime = max(self.maxTime, elapsed)
+        return 'w' if target < current else 's' if target > current else ''
+
+def playAutopilot(job):
+    # one headless game with the autopilot riding
+    seed, width, height, ticks, spawnRate, budget = job
+    engine = Engine(width, height, seed, spawnRate)
+    autopilot = Autopilot(budget)
+    elapsed = runHeadless(engine, {}, ticks, autopilot)
+    return engine.distance, engine.gameOver, engine.ticks, elapsed, autopilot.decisions, autopilot.totalTime, autopilot.maxTime, autopilot.cutShort
+
+def autopilotBenchmark(games, workers, width, height, ticks, spawnRate=SPAWN_RATE, budget=AUTOPILOT_BUDGET, seed=0):
+    jobs = [(seed + game, width, height, ticks, spawnRate, budget) for game in range(games)]
+    started = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool:
+        results = list(pool.imap_unordered(playAutopilot, jobs, chunksize=max(1, games // (workers * 16))))
+    wall = time.perf_counter() - started
+
+    distances = sorted(result[0] for result in results)
+    crashes = sum(result[1] for result in results)
+    totalTicks = sum(result[2] for result in results)
+    gameTime = sum(result[3] for result in results)
+    decisions = sum(result[4] for result in results)
+    thinking = sum(result[5] for result in results)
+    slowest = max(result[6] for result in results)
+    cutShort = sum(result[7] for result in results)
+
+    print(f'{games} autopilot games on a {width}x{height} road, spawn rate {spawnRate}, at most {ticks:,} ticks each')
+    print(f'crashed in {crashes} ({crashes / games:.1%}), the rest rode out the {ticks:,} ticks')
+    deciles = statistics.quantiles(distances, n=10, method='inclusive') if games > 1 else distances * 9
+    print(f'distance: min {distances[0]:,}  mean {statistics.fmean(distances):,.0f}  max {distances[-1]:,}')
+    print('deciles:  ' + '  '.join(f'{decile:,.0f}' for decile in deciles))
+    print(f'decision latency: mean {thinking / decisions * 1e6:,.0f} us  max {slowest * 1e6:,.0f} us  '
+          f'budget {budget * 1e6:,.0f} us, cut short {cutShort / decisions:.2%}')
+    print(f'{totalTicks / gameTime:,.0f} ticks/s per worker with the autopilot, '
+          f'{totalTicks / (gameTime - thinking):,.0f} for the engine alone; {totalTicks / wall:,.0f} ticks/s on {workers} workers')
+
+def saveReplay(path, engine, events):
+    with open(path, 'wb') as file:
+        file.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, engine.seed, engine.width, engine.height, engine.ticks))
+        for tick, key in events:
+            file.write(REPLAY_EVENT.pack(tick, key.encode()))
+
+def loadReplay(path):
+    # returns (seed, width, height, ticks, {tick: keys})
+    with open(path, 'rb') as file:
+        data = file.read()
+    if len(data) < REPLAY_HEADER.size or (len(data) - REPLAY_HEADER.size) % REPLAY_EVENT.size:
+        raise ValueError(f'{path}: not a replay')
+    magic, version, seed, width, height, ticks = REPLAY_HEADER.unpack_from(data)
+    if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+        raise ValueError(f'{path}: not a replay')
+    events = {}
+    for tick, key in REPLAY_EVENT.iter_unpack(data[REPLAY_HEADER.size:]):
+        events[tick] = events.get(tick, '') + key.decode()
+    return seed, width, height, ticks, events
+
+def seedArgument(text):
+    # seeds are saved in replays as 64-bit unsigned, so only those are taken
+    seed = int(text)
+    if not 0 <= seed < 2 ** 64:
+        raise argparse.ArgumentTypeError(f'{seed} is not between 0 and 2**64 - 1')
+    return seed
+
+def runHeadless(engine, events, ticks, autopilot=None, recorded=None):
+    # ticks as fast as they go, with the keys of events or of the autopilot, the
+    # latter added to recorded if given; returns the time taken
+    started = time.perf_counter()
+    while not engine.gameOver and engine.ticks < ticks:
+        if autopilot:
+            keys = autopilot.decide(engine)
+            if recorded is not None:
+                recorded.extend((engine.ticks, key) for key in keys)
+        else:
+            keys = events.get(engine.ticks, '')
+        engine.tick(keys)
+    return time.perf_counter() - started
 
-def main(stdscr):
-    WIDTH = 50
-    HEIGHT = 50
+def main(stdscr, showStats=False, logPath=None, seed=None, recordPath=None, replay=None, autopilot=None):
     WIDTH, HEIGHT = os.get_terminal_size()
 
-    if WIDTH < WIDTH and HEIGHT < HEIGHT:
-        print(f'Window too small - Required size at least {WIDTH}x{HEIGHT}')
-        sys.exit(1)
-
-    def updateVehicles(randomizer):
-        nonlocal vehicles
-        if random.random() < randomizer:
-            x = 2
-            lane = random.randrange(SIDEWALK_OFFSET, HEIGHT - SIDEWALK_OFFSET + 1, 2)
-            vehicles.append(Vehicle(x, lane, getRandomVehicle()))
-
-    def initTrees():
-        TREE_OFFSET = 5
-        yTop = TREE_OFFSET - 3
-        yBot = HEIGHT - TREE_OFFSET + 3
-        trees = []
-
-        for i in range(round(WIDTH / TREE_OFFSET)):
-            x = TREE_OFFSET * i
-            trees.append(Tree(x, yTop, getRandomTree()))
-            trees.append(Tree(x, yBot, getRandomTree()))
-        return trees
-
-    def initLaneLines():
-        laneLines = []
-        LANE_LINE_OFFSET = 7
-        for y in range(3, HEIGHT - 3, 2):
-            for x in range(round(WIDTH / LANE_LINE_OFFSET)):
-                laneLines.append(LaneLine(x * LANE_LINE_OFFSET, y))
-        return laneLines
-
-    def drawPlayer():
-        stdscr.addstr(player.y, player.x, player.img)
-
-    def drawSidewalk():
-        stdscr.addstr(SIDEWALK_OFFSET - 1, 0, '_' * WIDTH)
-        stdscr.addstr(HEIGHT - SIDEWALK_OFFSET + 1, 0, '_' * WIDTH)
-
-    def drawTree():
-        nonlocal trees
-        for tree in trees:
-            stdscr.addstr(tree.y, tree.x, tree.img)
-
-    def drawLaneLine():
-        nonlocal laneLines
-        for laneLine in laneLines:
-            stdscr.addstr(laneLine.y, laneLine.x, laneLine.img)
-
-    def drawVehicle():
-        nonlocal vehicles
-        for vehicle in vehicles:
-            stdscr.addstr(vehicle.y, vehicle.x, vehicle.img)
-
-    def passTime():
-        nonlocal distance
-        nonlocal trees
-        nonlocal laneLines
-        nonlocal vehicles
-
-        distance += 1
-
-        for tree in trees:
-            tree.x = tree.x + 1 if tree.x < WIDTH - 1 else 0
-
-        for laneLine in laneLines:
-            laneLine.x = laneLine.x + 1 if laneLine.x < WIDTH - 1 else 0
-
-        tmp = []
-        for vehicle in vehicles:
-            if vehicle.x < WIDTH - 1:
-                vehicle.x += 1
-                tmp.append(vehicle)
-        vehicles = tmp
-
-    def checkCollision():
-        nonlocal gameOver
-
-        for vehicle in vehicles:
-            if vehicle.x == player.x and vehicle.y == player.y:
-                player.img = '💥'
-                gameOver = True
-
-    def switchLane(direction):
-        if direction == UP and player.y > SIDEWALK_OFFSET or direction == DOWN and player.y < HEIGHT - SIDEWALK_OFFSET:
-            player.y += direction
-
-    curses.curs_set(0)          # Hide cursor
-    stdscr.nodelay(True)        # Non-blocking input
-    stdscr.timeout(10)          # Refresh every 50 ms (~20 FPS)
+    if WIDTH < MIN_WIDTH or HEIGHT < MIN_HEIGHT:
+        # raised rather than printed so it shows once curses has let go of the terminal
+        sys.exit(f'Window too small - {WIDTH}x{HEIGHT}, required size at least {MIN_WIDTH}x{MIN_HEIGHT}')
 
-    UP = -2
-    DOWN = 2
-    SIDEWALK_OFFSET = 4
+    def render():
+        engine.draw(screen)
 
-    gameOver = False
-    playerY = round(HEIGHT / 2)
-    player = Player(WIDTH - SIDEWALK_OFFSET - 10, playerY if playerY % 2 == 0 else playerY + 1)
-    distance = 0
-    timeout = 0.02
+        screen.put(0, 0, 'Press Q to quit')
+        screen.put(1, 0, f'Distance: {engine.distance}')
+        if showStats:
+            text = (f'{engine.ticksPerSecond():.0f} ticks/s  update {averages["update"]:.2f} ms  render {averages["render"]:.2f} ms  '
+                    f'sleep jitter {averages["jitter"]:+.2f} ms  dropped {dropped}  {screen.lastBytes:,} B/frame')
+            screen.put(0, max(WIDTH - len(text), 16), text)
+        screen.present()
 
-    vehicles = []
-    trees = initTrees()
-    laneLines = initLaneLines()
+    def report(ticks, update, render, jitter):
+        # times in s; averaged for the screen, every frame to the log
+        for name, value in (('update', update), ('render', render), ('jitter', jitter)):
+            averages[name] += (value * 1000 - averages[name]) * STATS_SMOOTHING
+        if log:
+            log.write(f'{screen.frames},{engine.distance},{ticks},{update * 1000:.3f},{render * 1000:.3f},{jitter * 1000:.3f},{dropped},{screen.lastBytes}\n')
 
-    while not gameOver:
+    curses.curs_set(0)          # Hide cursor
+    stdscr.nodelay(True)        # Non-blocking input
+    measure(stdscr, SPRITES + [Player.img])  # how wide the emoji really are here
+
+    screen = Screen(stdscr)
+    if replay:
+        seed, WIDTH, HEIGHT, lastTick, events = replay
+    else:
+        lastTick = None
+        events = {}
+    engine = Engine(WIDTH, HEIGHT, random.getrandbits(64) if seed is None else seed)
+    pending = ''  # keys pressed since the last tick
+    recorded = []  # (tick, key)
+
+    dropped = 0  # ticks simulated without a frame drawn for them
+    averages = {'update': 0.0, 'render': 0.0, 'jitter': 0.0}  # ms
+    log = open(logPath, 'w') if logPath else None
+    if log:
+        log.write('frame,distance,ticks,update_ms,render_ms,sleep_jitter_ms,dropped,bytes\n')
+
+    render()
+    accumulator = 0.0  # s of simulation owed
+    previous = time.perf_counter()
+
+    while not engine.gameOver and engine.ticks != lastTick:
         key = stdscr.getch()
 
         if key == ord('q'):
             break
-        elif key == ord('w'):
-            switchLane(UP)
-        elif key == ord('s'):
-            switchLane(DOWN)
-
-        stdscr.clear()
-
-        drawSidewalk()
-        drawTree()
-        drawLaneLine()
-        drawVehicle()
-        checkCollision()
-        drawPlayer()
-        updateVehicles(0.1)
-        passTime()
-
-        stdscr.addstr(0, 0, 'Press Q to quit')
-        stdscr.addstr(1, 0, f'Distance: {distance}')
-        stdscr.refresh()
-
-        if gameOver:
-            time.sleep(2)
-        else:
-            timeout -= 0.0001
-            if timeout < 0:
-                timeout = 0
-            time.sleep(timeout)
-
+        elif key == curses.KEY_RESIZE:
+            screen.resize()
+        elif key in (ord('w'), ord('s')) and not replay and not autopilot:
+            pending += chr(key)
+
+        now = time.perf_counter()
+        accumulator += min(now - previous, MAX_FRAME_TIME)
+        previous = now
+
+        # as many fixed ticks as the time since the last frame holds
+        ticks = 0
+        while accumulator >= 1 / engine.ticksPerSecond() and not engine.gameOver and engine.ticks != lastTick:
+            accumulator -= 1 / engine.ticksPerSecond()
+            if replay:
+                keys = events.get(engine.ticks, '')
+            elif autopilot:
+                keys = autopilot.decide(engine)
+            else:
+                keys = pending
+            recorded.extend((engine.ticks, key) for key in keys)
+            pending = ''
+            engine.tick(keys)
+            ticks += 1
+        dropped += max(ticks - 1, 0)
+        updated = time.perf_counter()
+
+        if ticks:
+            render()
+        rendered = time.perf_counter()
+
+        # sleep until the next tick is due
+        delay = max(1 / engine.ticksPerSecond() - accumulator - (rendered - now), 0)
+        time.sleep(delay)
+        jitter = time.perf_counter() - rendered - delay
+        if ticks:
+            report(ticks, updated - now, rendered - updated, jitter)
+
+    if log:
+        log.close()
+    if recordPath:
+        saveReplay(recordPath, engine, recorded)
+    if engine.gameOver:
+        time.sleep(2)
+
+    return screen, engine
 
 if __name__ == '__main__':
-    curses.wrapper(main)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--stats', action='store_true', help='show update and render times, sleep jitter and dropped frames')
+    parser.add_argument('--log', metavar='FILE', help='write those figures for every frame to a CSV file')
+    parser.add_argument('--bench', action='store_true', help='measure simulation ticks/s against terminal width and exit')
+    parser.add_argument('--seed', type=seedArgument, help='seed for the traffic and scenery, random when left out')
+    parser.add_argument('--record', metavar='FILE', help='save the seed and key presses of the run as a replay')
+    parser.add_argument('--replay', metavar='FILE', help='play a recorded run back')
+    parser.add_argument('--headless', action='store_true', help='run without a terminal, as fast as possible, and print the outcome')
+    parser.add_argument('--ticks', type=int, help='most ticks a headless run without a replay goes on for, 100000 by default and 5000 per game with --autobench')
+    parser.add_argument('--size', type=int, nargs=2, default=(80, 24), metavar=('WIDTH', 'HEIGHT'), help='road size of a headless run without a replay')
+    parser.add_argument('--autopilot', action='store_true', help='let the lookahead autopilot ride')
+    parser.add_argument('--budget', type=float, default=AUTOPILOT_BUDGET * 1000, help='autopilot thinking time per tick in ms')
+    parser.add_argument('--autobench', type=int, metavar='GAMES', help='ride this many seeded headless games with the autopilot and report how far they get')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes for --autobench')
+    parser.add_argument('--spawn-rate', type=float, default=SPAWN_RATE, help='chance of a new vehicle each tick, for --autobench')
+    args = parser.parse_args()
+    if args.size[0] < MIN_WIDTH or args.size[1] < MIN_HEIGHT:
+        parser.error(f'--size must be at least {MIN_WIDTH} {MIN_HEIGHT}')
+    autopilot = Autopilot(args.budget / 1000) if args.autopilot else None
+
+    if args.autobench:
+        autopilotBenchmark(args.autobench, args.workers, *args.size, args.ticks or 5000, args.spawn_rate, args.budget / 1000, args.seed or 0)
+        sys.exit(0)
+
+    if args.bench:
+        benchmark()
+        sys.exit(0)
+
+    replay = None
+    if args.replay:
+        try:
+            replay = loadReplay(args.replay)
+        except (OSError, ValueError) as error:
+            print(f'ERROR: {error}')
+            sys.exit(1)
+
+    if args.headless:
+        if replay:
+            seed, width, height, ticks, events = replay
+        else:
+            seed = random.getrandbits(64) if args.seed is None else args.seed
+            (width, height), ticks, events = args.size, args.ticks or 100000, {}
+        engine = Engine(width, height, seed)
+        recorded = [(tick, key) for tick, keys in sorted(events.items()) for key in keys]
+        elapsed = runHeadless(engine, events, ticks, None if replay else autopilot, recorded)
+        outcome = 'crashed' if engine.gameOver else 'still riding'
+        print(f'seed {seed}: {outcome} after {engine.ticks:,} ticks, distance {engine.distance:,}')
+        print(f'{engine.ticks / elapsed:,.0f} ticks/s')
+        if args.record:
+            saveReplay(args.record, engine, recorded)
+        sys.exit(0)
+
+    screen, engine = curses.wrapper(main, args.stats, args.log, args.seed, args.record, replay, autopilot)
+    if screen.frames:
+        print(f'{screen.frames} frames, {screen.totalBytes / screen.frames:,.0f} bytes/frame on average, {screen.maxBytes:,} at most')
+    print(f'seed {engine.seed}: distance {engine.distance:,} after {engine.ticks:,} ticks')
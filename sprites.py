@@ -0,0 +1,142 @@
+import os
+import re
+import sys
+import time
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+
+# Emoji for the curses games. A sprite is text whose width on screen is not one
+# cell per character: an emoji with a skin tone, a ZWJ sequence, a symbol made
+# wide by VS16. Unicode tables only guess at those and terminals disagree with
+# each other and with curses, so the width of every glyph is asked of the
+# terminal once at startup and kept.
+
+MEASURE_TIMEOUT = 0.2  # s to wait for the terminal to say where the cursor went
+CURSOR_REPORT = re.compile(r'\x1b\[(\d+);(\d+)R')
+
+widths = {}  # glyph -> cells it takes on this terminal, as measured
+sprites = {}  # text -> Sprite
+
+@dataclass
+class Sprite:
+    text: str
+    glyphs: tuple  # (glyph, cells) pairs
+    cells: int
+    data: bytes  # the text as it goes to the terminal
+    blank: bytes  # spaces over the same cells
+
+def isZeroWidth(char):
+    # combining marks, variation selectors and joiners draw no cell of their own
+    return unicodedata.combining(char) or unicodedata.category(char) in ('Mn', 'Me', 'Cf') or '\ufe00' <= char <= '\ufe0f'
+
+def isModifier(char):
+    # skin tones, which join the emoji before them
+    return '\U0001f3fb' <= char <= '\U0001f3ff'
+
+def splitGlyphs(text):
+    # a glyph is a character with the zero-width ones and modifiers that follow
+    # it, e.g. 🏍 + VS16, or a whole ZWJ sequence
+    glyphs = []
+    join = False
+    for char in text:
+        if glyphs and (join or isZeroWidth(char) or isModifier(char)):
+            glyphs[-1] += char
+        else:
+            glyphs.append(char)
+        join = char == '\u200d'
+    return glyphs
+
+def guessWidth(glyph):
+    return 2 if '\ufe0f' in glyph or unicodedata.east_asian_width(glyph[0]) in 'WF' else 1
+
+@lru_cache(maxsize=1024)
+def layout(text):
+    # text as (glyph, cells) pairs
+    return tuple((glyph, widths.get(glyph) or guessWidth(glyph)) for glyph in splitGlyphs(text))
+
+def getSprite(text):
+    sprite = sprites.get(text)
+    if sprite is None:
+        glyphs = layout(text)
+        cells = sum(cells for _, cells in glyphs)
+        sprite = sprites[text] = Sprite(text, glyphs, cells, text.encode(), b' ' * cells)
+    return sprite
+
+def measure(stdscr, texts):
+    # Draws each glyph of texts not measured yet in the top left corner and reads
+    # back the cursor position report (ESC [ 6 n) to see how far it went. A
+    # terminal that does not answer keeps the guesses. Call before drawing
+    # anything; stdscr is left non-blocking, as the games run it.
+    glyphs = sorted({glyph for text in texts for glyph in splitGlyphs(text) if not glyph.isascii()} - widths.keys())
+    if not glyphs:
+        return
+    stdscr.keypad(False)  # or the report could be taken for a function key
+    stdscr.nodelay(True)
+    try:
+        for glyph in glyphs:
+            cells = queryWidth(stdscr, glyph)
+            if cells is None:
+                break
+            if cells > 0:
+                widths[glyph] = cells
+    finally:
+        stdscr.keypad(True)
+        stdscr.clearok(True)  # repaint whatever the probes left behind
+    layout.cache_clear()
+    sprites.clear()
+
+def queryWidth(stdscr, glyph):
+    os.write(sys.stdout.fileno(), b'\x1b[1;1H' + glyph.encode() + b'\x1b[6n')
+    reply = ''
+    deadline = time.perf_counter() + MEASURE_TIMEOUT
+    while time.perf_counter() < deadline:
+        key = stdscr.getch()
+        if key == -1:
+            time.sleep(0.001)
+            continue
+        reply += chr(key)
+        report = CURSOR_REPORT.search(reply)
+        if report:
+            return int(report.group(2)) - 1
+    return None
+
+class SpriteLayer:
+    # Sprites drawn over a curses window straight to the terminal. curses works
+    # out widths per character, so it loses track of the cursor after a ZWJ
+    # sequence and redraws it as loose pieces. Here curses is only told of
+    # blanks where a sprite goes, and the sprite's bytes are written after
+    # curses has drawn the frame, with the cursor saved and restored around them
+    # so curses still knows where it is. A sprite that moves or goes is blanked
+    # on the terminal first; curses already holds blanks there and draws
+    # whatever replaces it.
+    def __init__(self, stdscr):
+        self.stdscr = stdscr
+        self.stdscr.idcok(False)  # shifting characters along would shift sprites too
+        self.height, self.width = stdscr.getmaxyx()
+        self.shown = []  # (y, x, sprite) on the terminal
+        self.placed = []  # (y, x, sprite) for the next frame
+
+    def place(self, y, x, sprite):
+        # whole sprites only; one that does not fit is left out
+        if not 0 <= y < self.height or x < 0 or x + sprite.cells > self.width:
+            return
+        if y == self.height - 1 and x + sprite.cells == self.width:
+            return  # writing the bottom right cell scrolls the terminal
+        self.stdscr.addstr(y, x, ' ' * sprite.cells)
+        self.placed.append((y, x, sprite))
+
+    def present(self):
+        gone = b''.join(self.__at(y, x, sprite.blank) for y, x, sprite in self.shown if (y, x, sprite) not in self.placed)
+        if gone:
+            os.write(sys.stdout.fileno(), b'\x1b7' + gone + b'\x1b8')
+        self.stdscr.refresh()
+        # every sprite every frame: curses may have cleared a row under one
+        drawn = b''.join(self.__at(y, x, sprite.data) for y, x, sprite in self.placed)
+        if drawn:
+            os.write(sys.stdout.fileno(), b'\x1b7' + drawn + b'\x1b8')
+        self.shown = self.placed
+        self.placed = []
+
+    def __at(self, y, x, data):
+        return f'\x1b[{y + 1};{x + 1}H'.encode() + data